@@ -0,0 +1,18 @@
+# atomic_write.py
+
+import os
+import threading
+from typing import Callable
+
+
+def write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """Write to a temporary file and move it into place, so readers never see a partial file."""
+    # Unique per process and thread, so concurrent tasks writing the same path never share a temporary file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,229 @@
+from prefect import flow, task
+from datetime import datetime
+import glob
+import hashlib
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from atomic_write import write_atomically
+
+BOXSCORE_PARQUET_DIR = "./boxscore_parquet"
+COMPACTED_DIR_NAME = "compacted"
+MANIFEST_FILE_NAME = "_manifest.json"
+LOCK_FILE_NAME = "_compaction.lock"
+
+# Files younger than this may still be being written by a flow run
+MIN_FILE_AGE_SECONDS = 60
+# A lock older than this was left behind by a compaction that died
+STALE_LOCK_SECONDS = 60 * 60
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def compacted_dir(source_dir):
+    return os.path.join(source_dir, COMPACTED_DIR_NAME)
+
+
+def load_manifest(source_dir=BOXSCORE_PARQUET_DIR):
+    '''Load the manifest of compacted partitions, or an empty one if nothing was compacted yet.'''
+    manifest_path = os.path.join(compacted_dir(source_dir), MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {'partitions': {}, 'source_files': []}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def write_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+
+
+def acquire_lock(lock_path):
+    '''Take the compaction lock; returns False if another compaction holds it.'''
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if time.time() - os.path.getmtime(lock_path) < STALE_LOCK_SECONDS:
+            return False
+        print(f"Removing stale compaction lock {lock_path}")
+        os.remove(lock_path)
+        return acquire_lock(lock_path)
+    with os.fdopen(fd, 'w') as f:
+        f.write(f"{os.getpid()} {datetime.now().isoformat()}")
+    return True
+
+
+def partition_key(team_name, search_start_date):
+    '''Partition directory for a team and the month its search window starts in, e.g. team=marlins/month=2024-06.'''
+    month = datetime.strptime(search_start_date, "%m/%d/%Y").strftime("%Y-%m")
+    return f"team={team_name.lower()}/month={month}"
+
+
+@task
+def find_small_files(source_dir, manifest, min_file_age=MIN_FILE_AGE_SECONDS):
+    '''This task will find the per-run files that are finished being written and not compacted yet.'''
+    already_compacted = set(manifest['source_files'])
+    now = time.time()
+
+    small_files = []
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.parquet"))):
+        file_name = os.path.basename(path)
+        # Skip files that may still be being written
+        if file_name in already_compacted or now - os.path.getmtime(path) < min_file_age:
+            continue
+        small_files.append(path)
+
+    print(f"Found {len(small_files)} files to compact")
+    return small_files
+
+
+@task
+def group_by_partition(small_files):
+    '''This task will read the small files and group their rows by team and month.'''
+    tables_by_partition = {}
+    read_files = []
+    for path in small_files:
+        try:
+            table = pq.read_table(path)
+        except (pa.ArrowInvalid, OSError) as e:
+            # Leave unreadable files for the next run rather than failing the compaction
+            print(f"Skipping unreadable file {path}: {e}")
+            continue
+
+        read_files.append(path)
+        table = table.append_column('source_file', pa.array([os.path.basename(path)] * table.num_rows, pa.string()))
+        for index in range(table.num_rows):
+            row = table.slice(index, 1)
+            key = partition_key(row['chosen_team_name'][0].as_py(), row['search_start_date'][0].as_py())
+            tables_by_partition.setdefault(key, []).append(row)
+
+    new_rows = {key: pa.concat_tables(tables, promote_options="default") for key, tables in tables_by_partition.items()}
+    return new_rows, read_files
+
+
+@task
+def compact_partition(source_dir, key, new_rows, manifest):
+    '''This task will merge new rows into a partition's compacted file and return its manifest entry.'''
+    partition_dir = os.path.join(compacted_dir(source_dir), key)
+    os.makedirs(partition_dir, exist_ok=True)
+
+    tables = [pq.read_table(os.path.join(compacted_dir(source_dir), path)) for path in manifest['partitions'].get(key, {}).get('files', [])]
+    tables.append(new_rows)
+    table = pa.concat_tables(tables, promote_options="default")
+
+    # Keep one copy of every source file's rows, so a compaction that died half way can simply be rerun
+    source_files = table['source_file'].to_pylist()
+    keep = sorted({source_file: index for index, source_file in enumerate(source_files)}.values())
+    table = table.take(keep).sort_by('source_file')
+
+    # Name the file after its contents, so rewriting the same data gives the same file
+    content_hash = hashlib.sha256('\n'.join(table['source_file'].to_pylist()).encode()).hexdigest()[:16]
+    file_name = f"part-{content_hash}.parquet"
+    write_atomically(
+        os.path.join(partition_dir, file_name),
+        lambda path: pq.write_table(table, path, row_group_size=ROW_GROUP_SIZE),
+    )
+
+    return {
+        'files': [f"{key}/{file_name}"],
+        'rows': table.num_rows,
+        'source_files': len(pc.unique(table['source_file'])),
+    }
+
+
+@task
+def update_manifest(source_dir, manifest, partitions, compacted_files):
+    '''This task will record the new partition files and the compacted source files in the manifest.'''
+    # Files the new partition files replace
+    replaced = [
+        os.path.join(compacted_dir(source_dir), path)
+        for key in partitions
+        for path in manifest['partitions'].get(key, {}).get('files', [])
+        if path not in partitions[key]['files']
+    ]
+
+    manifest['partitions'].update(partitions)
+    # Only files still on disk need skipping, so files removed after an earlier compaction are dropped
+    source_files = set(manifest['source_files']) | {os.path.basename(path) for path in compacted_files}
+    manifest['source_files'] = sorted(
+        file_name for file_name in source_files if os.path.exists(os.path.join(source_dir, file_name))
+    )
+    manifest['updated_at'] = datetime.now().isoformat()
+    write_atomically(
+        os.path.join(compacted_dir(source_dir), MANIFEST_FILE_NAME),
+        lambda path: write_json(manifest, path),
+    )
+
+    # Only remove files once the manifest no longer points at them
+    for path in replaced:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return manifest
+
+
+@task
+def remove_compacted_files(source_dir, manifest):
+    '''This task will delete the per-run files whose rows are in the compacted partitions.'''
+    removed = 0
+    for file_name in manifest['source_files']:
+        path = os.path.join(source_dir, file_name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    print(f"Removed {removed} compacted files")
+    return removed
+
+
+def read_compacted(teams=None, months=None, source_dir=BOXSCORE_PARQUET_DIR):
+    '''Read the compacted analysis rows for some teams and months, listing partitions from the manifest.'''
+    manifest = load_manifest(source_dir)
+    paths = []
+    for key, partition in manifest['partitions'].items():
+        team, month = (part.split('=', 1)[1] for part in key.split('/'))
+        if (teams is None or team in teams) and (months is None or month in months):
+            paths.extend(os.path.join(compacted_dir(source_dir), path) for path in partition['files'])
+    if not paths:
+        return None
+    return pa.concat_tables([pq.read_table(path) for path in paths], promote_options="default")
+
+
+@flow
+def compact_boxscore_parquet(source_dir=BOXSCORE_PARQUET_DIR, remove_sources=True, min_file_age=MIN_FILE_AGE_SECONDS):
+    os.makedirs(compacted_dir(source_dir), exist_ok=True)
+    lock_path = os.path.join(compacted_dir(source_dir), LOCK_FILE_NAME)
+
+    # Only one compaction at a time; flow runs writing new files are never blocked
+    if not acquire_lock(lock_path):
+        print("Another compaction is running, skipping this run")
+        return
+
+    try:
+        manifest = load_manifest(source_dir)
+
+        # Find the files to compact and group their rows by team and month
+        small_files = find_small_files(source_dir, manifest, min_file_age)
+        new_rows, compacted_files = group_by_partition(small_files)
+
+        # Rewrite every partition that has new rows
+        partitions = {key: compact_partition(source_dir, key, rows, manifest) for key, rows in new_rows.items()}
+
+        # Point the manifest at the new files
+        manifest = update_manifest(source_dir, manifest, partitions, compacted_files)
+
+        # Clean up the small files
+        if remove_sources:
+            remove_compacted_files(source_dir, manifest)
+    finally:
+        os.remove(lock_path)
+
+
+if __name__ == "__main__":
+    compact_boxscore_parquet()
+
+    # compact_boxscore_parquet.serve(
+    #     name="compact-boxscore-parquet",
+    #     cron="0 3 * * *"
+    # )
@@ -0,0 +1,345 @@
+# game_stats.py
+
+import glob
+import json
+import math
+import os
+from typing import Dict, Iterable, List, Optional
+
+from atomic_write import write_atomically
+
+ANALYSIS_STATE_DIR = "./analysis_state"
+
+
+class RunningMoments:
+    """Count, mean, variance, min and max of a stream of values, using Welford's method."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        """Combine two sets of moments as if all values had been added to one."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.__dict__.update(other.to_dict())
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "RunningMoments":
+        return cls(**state)
+
+
+class CoMoments:
+    """Running co-moment of paired values, for their Pearson correlation."""
+
+    def __init__(self, count=0, mean_x=0.0, mean_y=0.0, m2_x=0.0, m2_y=0.0, c_xy=0.0):
+        self.count = count
+        self.mean_x = mean_x
+        self.mean_y = mean_y
+        self.m2_x = m2_x
+        self.m2_y = m2_y
+        self.c_xy = c_xy
+
+    def add(self, x: float, y: float) -> None:
+        self.count += 1
+        delta_x = x - self.mean_x
+        delta_y = y - self.mean_y
+        self.mean_x += delta_x / self.count
+        self.mean_y += delta_y / self.count
+        self.m2_x += delta_x * (x - self.mean_x)
+        self.m2_y += delta_y * (y - self.mean_y)
+        self.c_xy += delta_x * (y - self.mean_y)
+
+    def merge(self, other: "CoMoments") -> "CoMoments":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.__dict__.update(other.to_dict())
+            return self
+        count = self.count + other.count
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        weight = self.count * other.count / count
+        self.m2_x += other.m2_x + delta_x * delta_x * weight
+        self.m2_y += other.m2_y + delta_y * delta_y * weight
+        self.c_xy += other.c_xy + delta_x * delta_y * weight
+        self.mean_x += delta_x * other.count / count
+        self.mean_y += delta_y * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def correlation(self) -> float:
+        if self.m2_x == 0 or self.m2_y == 0:
+            return math.nan
+        return self.c_xy / math.sqrt(self.m2_x * self.m2_y)
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "CoMoments":
+        return cls(**state)
+
+
+class HistogramSketch:
+    """
+    Quantile sketch that counts values per bucket of width resolution.
+
+    Game times in minutes and score differentials are whole numbers over a
+    small range, so with the default resolution of 1 the sketch stays a few
+    hundred buckets at most and its quantiles match pandas exactly.
+    """
+
+    def __init__(self, resolution: float = 1.0, counts: Optional[Dict[float, int]] = None):
+        self.resolution = resolution
+        self.counts = counts or {}
+
+    def add(self, value: float) -> None:
+        bucket = round(value / self.resolution) * self.resolution
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other: "HistogramSketch") -> "HistogramSketch":
+        if other.resolution != self.resolution:
+            raise ValueError("Can only merge sketches with the same resolution")
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Quantile with linear interpolation between ranks, like pandas."""
+        total = sum(self.counts.values())
+        if total == 0:
+            return math.nan
+        position = (total - 1) * q
+        lower_rank, upper_rank = math.floor(position), math.ceil(position)
+
+        lower = upper = None
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if lower is None and seen > lower_rank:
+                lower = bucket
+            if seen > upper_rank:
+                upper = bucket
+                break
+        return lower + (upper - lower) * (position - lower_rank)
+
+    def to_dict(self) -> Dict:
+        return {
+            "resolution": self.resolution,
+            "counts": [[bucket, count] for bucket, count in sorted(self.counts.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "HistogramSketch":
+        return cls(state["resolution"], {bucket: count for bucket, count in state["counts"]})
+
+
+class GameStats:
+    """
+    The analyze_games statistics for a set of games, updated one game at a time.
+
+    The values of every game are kept by game ID. Feeding the same game in
+    again is a no-op, unless it now has a value that was missing before, e.g.
+    a game time that couldn't be parsed; then the game replaces its earlier
+    contribution. merge() combines the state of several sets of games, e.g.
+    seasons or teams: disjoint sets by merging their moments and sketches,
+    overlapping ones, such as two teams that played each other, by counting
+    the shared games once.
+    """
+
+    def __init__(self):
+        self.games: Dict[int, List[Optional[float]]] = {}
+        self._reset()
+
+    def _reset(self) -> None:
+        self.game_time = RunningMoments()
+        self.differential = RunningMoments()
+        self.game_time_sketch = HistogramSketch()
+        self.differential_sketch = HistogramSketch()
+        self.time_differential = CoMoments()
+
+    def _add_values(self, game_time_in_minutes, score_differential) -> None:
+        if game_time_in_minutes is not None:
+            self.game_time.add(game_time_in_minutes)
+            self.game_time_sketch.add(game_time_in_minutes)
+        if score_differential is not None:
+            self.differential.add(score_differential)
+            self.differential_sketch.add(score_differential)
+        if game_time_in_minutes is not None and score_differential is not None:
+            self.time_differential.add(game_time_in_minutes, score_differential)
+
+    def _rebuild(self) -> None:
+        self._reset()
+        for game_time_in_minutes, score_differential in self.games.values():
+            self._add_values(game_time_in_minutes, score_differential)
+
+    def _set_game(self, game_id, game_time_in_minutes, score_differential) -> Optional[str]:
+        """Record a game's values; returns "new", "changed", or None if nothing changed."""
+        previous = self.games.get(game_id)
+        if previous is None:
+            self.games[game_id] = [game_time_in_minutes, score_differential]
+            self._add_values(game_time_in_minutes, score_differential)
+            return "new"
+
+        # Known values are never replaced by missing ones
+        values = [
+            new if new is not None else old
+            for new, old in zip((game_time_in_minutes, score_differential), previous)
+        ]
+        if values == previous:
+            return None
+        self.games[game_id] = values
+        return "changed"
+
+    @property
+    def game_ids(self):
+        return self.games.keys()
+
+    def add_game(self, game_id, game_time_in_minutes, score_differential) -> bool:
+        """Add or correct one game; returns False if it was already counted with the same values."""
+        change = self._set_game(game_id, game_time_in_minutes, score_differential)
+        if change == "changed":
+            self._rebuild()
+        return change is not None
+
+    def add_games(self, games: Iterable[Dict]) -> int:
+        """Add or correct game records in one pass; returns how many were new or corrected."""
+        changes = [
+            self._set_game(
+                game["game_id"], game["game_time_in_minutes"], game["score_differential"]
+            )
+            for game in games
+        ]
+        # Take corrected games' earlier values out by recomputing once
+        if "changed" in changes:
+            self._rebuild()
+        return sum(change is not None for change in changes)
+
+    def merge(self, other: "GameStats") -> "GameStats":
+        if not self.games.keys().isdisjoint(other.games):
+            # Merging the moments would count the shared games twice
+            self.add_games(
+                {"game_id": game_id, "game_time_in_minutes": game_time, "score_differential": differential}
+                for game_id, (game_time, differential) in other.games.items()
+            )
+            return self
+        self.games.update(other.games)
+        self.game_time.merge(other.game_time)
+        self.differential.merge(other.differential)
+        self.game_time_sketch.merge(other.game_time_sketch)
+        self.differential_sketch.merge(other.differential_sketch)
+        self.time_differential.merge(other.time_differential)
+        return self
+
+    def summary(self) -> Dict:
+        """Statistics with the same keys analyze_games reports."""
+
+        def value(number):
+            return math.nan if number is None else float(number)
+
+        return {
+            "max_game_time": value(self.game_time.maximum),
+            "min_game_time": value(self.game_time.minimum),
+            "median_game_time": self.game_time_sketch.quantile(0.5),
+            "average_game_time": self.game_time.mean if self.game_time.count else math.nan,
+            "max_differential": value(self.differential.maximum),
+            "min_differential": value(self.differential.minimum),
+            "median_differential": self.differential_sketch.quantile(0.5),
+            "average_differential": self.differential.mean if self.differential.count else math.nan,
+            "time_differential_correlation": self.time_differential.correlation,
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "games": [[game_id, *values] for game_id, values in sorted(self.games.items())],
+            "game_time": self.game_time.to_dict(),
+            "differential": self.differential.to_dict(),
+            "game_time_sketch": self.game_time_sketch.to_dict(),
+            "differential_sketch": self.differential_sketch.to_dict(),
+            "time_differential": self.time_differential.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "GameStats":
+        stats = cls()
+        stats.games = {game_id: list(values) for game_id, *values in state["games"]}
+        stats.game_time = RunningMoments.from_dict(state["game_time"])
+        stats.differential = RunningMoments.from_dict(state["differential"])
+        stats.game_time_sketch = HistogramSketch.from_dict(state["game_time_sketch"])
+        stats.differential_sketch = HistogramSketch.from_dict(state["differential_sketch"])
+        stats.time_differential = CoMoments.from_dict(state["time_differential"])
+        return stats
+
+    @classmethod
+    def load(cls, path: str) -> "GameStats":
+        """Load saved state, or start empty if there is none yet."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r") as f:
+            state = json.load(f)
+        if "games" not in state:
+            # Saved before per-game values were kept, so games with a missing
+            # game time can't be corrected; rebuild it from the games seen next
+            print(f"Rebuilding {path}, it has no per-game values")
+            return cls()
+        return cls.from_dict(state)
+
+    def save(self, path: str) -> None:
+        # Write to a temporary file first so a crash never leaves half a state file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state = self.to_dict()
+
+        def write(temp_path: str) -> None:
+            with open(temp_path, "w") as f:
+                json.dump(state, f)
+
+        write_atomically(path, write)
+
+
+def season_state_path(team: str, season: int, state_dir: str = ANALYSIS_STATE_DIR) -> str:
+    return os.path.join(state_dir, f"team={team}", f"season={season}.json")
+
+
+def rollup_season_stats(
+    teams: Optional[List[str]] = None,
+    seasons: Optional[List[int]] = None,
+    state_dir: str = ANALYSIS_STATE_DIR,
+) -> GameStats:
+    """Merge the saved state of the given teams and seasons (all of them by default)."""
+    rollup = GameStats()
+    for path in glob.glob(os.path.join(state_dir, "team=*", "season=*.json")):
+        team = os.path.basename(os.path.dirname(path))[len("team="):]
+        season = int(os.path.basename(path)[len("season="):-len(".json")])
+        if (teams is None or team in teams) and (seasons is None or season in seasons):
+            rollup.merge(GameStats.load(path))
+    return rollup
@@ -2,8 +2,29 @@ from prefect import flow, task, runtime
 from prefect.artifacts import create_markdown_artifact
 from datetime import datetime
 import statsapi
-import json
+import asyncio
+import httpx
 import pandas as pd
+import pyarrow.compute as pc
+from atomic_write import write_atomically
+from game_stats import ANALYSIS_STATE_DIR, GameStats, rollup_season_stats, season_state_path
+from raw_game_store import RAW_DATA_DIR, games_to_table, read_games, write_games
+
+MLB_GAME_FEED_URL = "https://statsapi.mlb.com/api/v1.1/game/{game_id}/feed/live"
+MAX_CONCURRENT_REQUESTS = 10
+
+# Number of longest and shortest games shown in the analysis artifact
+ARTIFACT_TOP_N = 10
+
+# Game times look like "2:45", "2:45." or "3:12 (1:16 delay)."; only the first
+# of several delay annotations is captured, the others are tolerated
+GAME_TIME_PATTERN = (
+    r"^\s*(?P<hours>\d+):(?P<minutes>\d{2})\s*"
+    r"(?:\((?P<delay_hours>\d+):(?P<delay_minutes>\d{2})\s*delay\)\s*)?"
+    r"(?:\(\d+:\d{2}\s*delay\)\s*)*"
+    r"\.?\s*$"
+)
+
 
 @task
 def get_recent_games(team_name, start_date, end_date):
@@ -15,150 +36,192 @@ def get_recent_games(team_name, start_date, end_date):
     return [game['game_id'] for game in schedule]
 
 
+async def fetch_game_feed(client, semaphore, game_id):
+    '''Fetch the live feed for a single game once a request slot is free.'''
+    async with semaphore:
+        response = await client.get(MLB_GAME_FEED_URL.format(game_id=game_id))
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_game_feeds(game_ids, max_concurrency):
+    '''Fetch the live feeds for all games over a single pooled HTTP client.'''
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        # gather returns the feeds in the same order as the game ids
+        return await asyncio.gather(*(fetch_game_feed(client, semaphore, game_id) for game_id in game_ids))
+
+
 @task
-def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
-    '''This task will fetch the boxscore for a single game and return the game data.'''
-    boxscore = statsapi.boxscore_data(game_id)
-    
-    # Extract relevant data
-    home_score = boxscore['home']['teamStats']['batting']['runs']
-    away_score = boxscore['away']['teamStats']['batting']['runs']
-    home_team = boxscore['teamInfo']['home']['teamName']
-    away_team = boxscore['teamInfo']['away']['teamName']
-    time_value = next(item['value'] for item in boxscore['gameBoxInfo'] if item['label'] == 'T')
-    
-    #Create a dictionary with the game data
-    game_data = {
-        'search_start_date': start_date,
-        'search_end_date': end_date,
-        'chosen_team_name': team_name,
-        'game_id': game_id,
-        'home_team': home_team,
-        'away_team': away_team,
-        'home_score': home_score,
-        'away_score': away_score,
-        'score_differential': abs(home_score - away_score),
-        'game_time': time_value,
-    }
-    
-    print(game_data)
-    return game_data
+def fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    '''This task will fetch the boxscores for all games concurrently and return the game data as an Arrow table.'''
+    feeds = asyncio.run(fetch_game_feeds(game_ids, max_concurrency))
+
+    all_game_data = []
+    for game_id, feed in zip(game_ids, feeds):
+        boxscore = feed['liveData']['boxscore']
+        teams = feed['gameData']['teams']
+        game_date = feed['gameData']['datetime']['officialDate']
+
+        # Extract relevant data
+        home_score = boxscore['teams']['home']['teamStats']['batting']['runs']
+        away_score = boxscore['teams']['away']['teamStats']['batting']['runs']
+        home_team = teams['home']['teamName']
+        away_team = teams['away']['teamName']
+        time_value = next(item['value'] for item in boxscore['info'] if item['label'] == 'T')
+
+        #Create a dictionary with the game data
+        game_data = {
+            'search_start_date': start_date,
+            'search_end_date': end_date,
+            'chosen_team_name': team_name,
+            'game_id': game_id,
+            'game_date': game_date,
+            'home_team': home_team,
+            'away_team': away_team,
+            'home_score': home_score,
+            'away_score': away_score,
+            'score_differential': abs(home_score - away_score),
+            'game_time': time_value,
+        }
+
+        print(game_data)
+        all_game_data.append(game_data)
+
+    return games_to_table(all_game_data)
 
 
 @task
-def save_raw_data_to_file(game_data, file_name):
-    '''This task will save the raw data to a file.'''
+def save_raw_data_to_store(game_data, start_date, end_date, data_path=RAW_DATA_DIR):
+    '''This task will append the game data to the Parquet store, partitioned by team and season.'''
     
-    with open(file_name, "w") as outfile:
-        json.dump(game_data, outfile, indent=4, sort_keys=True)
+    write_games(game_data, start_date, end_date, data_path)
     
-    print(file_name)
-    return file_name
+    print(data_path)
+    return data_path
 
 @task
-def clean_time_value(data_file_path):
-    '''This task will clean the time value.'''
-    
-    try:
-        with open(data_file_path, 'r') as f:
-            game_data_list = json.load(f)
-    except FileNotFoundError:
-        raise ValueError(f"File not found: {data_file_path}") 
-    except json.JSONDecodeError:
-        raise ValueError(f"Invalid JSON file: {data_file_path}")
-    
-    # Process each game in the list
-    for game_data in game_data_list:
-        # Remove any extra text like '(1:16 delay)'
-        if '(' in game_data['game_time']:
-            game_data['game_time'] = game_data['game_time'].split('(')[0]
-        
-        # Remove any non-digit, non-colon characters
-        game_data['game_time'] = ''.join(char for char in game_data['game_time'] if char.isdigit() or char == ':')
-        
-        hours, minutes = map(int, game_data['game_time'].split(':'))
-        game_data['game_time_in_minutes'] = hours * 60 + minutes
-    
-    # Save the modified data back to the file
-    with open(data_file_path, 'w') as f:
-        json.dump(game_data_list, f, indent=4, sort_keys=True)
+def load_raw_data_from_store(team_name, start_date, end_date, data_path=RAW_DATA_DIR):
+    '''This task will read the team's games for the date range back from the Parquet store, one row per game.'''
     
-    return data_file_path
+    # Only the team/season partitions and row groups of the date range are read
+    game_data = read_games(team_name, start_date, end_date, base_dir=data_path)
     
+    print(f"Read {game_data.num_rows} games from {data_path}")
+    return game_data
+
+def to_minutes(parsed, hours_field, minutes_field):
+    '''Combine an hours and a minutes field of the parsed game times into minutes; empty fields become null.'''
+    hours = pc.struct_field(parsed, hours_field)
+    minutes = pc.struct_field(parsed, minutes_field)
+    hours = pc.cast(pc.if_else(pc.equal(hours, ''), None, hours), 'int64')
+    minutes = pc.cast(pc.if_else(pc.equal(minutes, ''), None, minutes), 'int64')
+    return pc.add(pc.multiply(hours, 60), minutes)
+
 @task
-def analyze_games(data_file_path):
-    '''This task will analyze the game data and return the analysis.'''
+def clean_time_value(game_data):
+    '''This task will parse the time values of all games at once and return the cleaned table.'''
     
-    try:
-        with open(data_file_path, 'r') as f:
-            game_data = json.load(f)
-    except FileNotFoundError:
-        raise ValueError(f"File not found: {data_file_path}")
-    except json.JSONDecodeError:
-        raise ValueError(f"Invalid JSON file: {data_file_path}")
+    game_time = game_data.column('game_time')
     
-    # Convert to DataFrame
-    df = pd.DataFrame(game_data)
+    # Parse every game time in one pass; rows that don't match become null
+    parsed = pc.extract_regex(game_time, GAME_TIME_PATTERN)
+    game_time_in_minutes = to_minutes(parsed, 'hours', 'minutes')
     
-    #Get the search parameters
-    start_date = df['search_start_date'].unique()[0]
-    end_date = df['search_end_date'].unique()[0]
-    team_name = df['chosen_team_name'].unique()[0]
+    # Games without a delay annotation were not delayed
+    delay_minutes = pc.if_else(
+        pc.is_valid(parsed),
+        pc.fill_null(to_minutes(parsed, 'delay_hours', 'delay_minutes'), 0),
+        None,
+    )
     
-    # Calculate average, median, max, and min differential
-    avg_differential = float(df['score_differential'].mean())
-    median_differential = float(df['score_differential'].median())
-    max_differential = float(df['score_differential'].max())
-    min_differential = float(df['score_differential'].min())
-
+    # Report the games we couldn't parse instead of failing on the first one
+    bad_rows = game_data.filter(pc.invert(pc.is_valid(parsed)))
+    if bad_rows.num_rows:
+        print(f"Could not parse the game time of {bad_rows.num_rows} games:")
+        for game in bad_rows.select(['game_id', 'game_time']).to_pylist():
+            print(game)
     
-    # Calculate average, median, max, and min game time
-    avg_game_time = float(df['game_time_in_minutes'].mean())
-    median_game_time = float(df['game_time_in_minutes'].median())
-    max_game_time = float(df['game_time_in_minutes'].max())
-    min_game_time = float(df['game_time_in_minutes'].min())
+    game_data = game_data.set_column(game_data.schema.get_field_index('game_time_in_minutes'), 'game_time_in_minutes', game_time_in_minutes)
+    return game_data.set_column(game_data.schema.get_field_index('delay_minutes'), 'delay_minutes', delay_minutes)
     
-    # Calculate correlation between game time and score differential
-    correlation = float(df['game_time_in_minutes'].corr(df['score_differential']))
+@task
+def analyze_games(game_data, team_name, start_date, end_date):
+    '''This task will analyze the game data and return the analysis.'''
+    
+    if game_data.num_rows == 0:
+        raise ValueError(f"No games found for {team_name} between {start_date} and {end_date}")
+    
+    # Calculate every statistic in a single pass over the games
+    stats = GameStats()
+    stats.add_games(game_data.select(['game_id', 'game_time_in_minutes', 'score_differential']).to_pylist())
     
     game_analysis = {
         'search_start_date': start_date,
         'search_end_date': end_date,
         'chosen_team_name': team_name,
-        'max_game_time': max_game_time,
-        'min_game_time': min_game_time,
-        'median_game_time': median_game_time,
-        'average_game_time': avg_game_time,
-        'max_differential': max_differential,
-        'min_differential': min_differential,
-        'median_differential': median_differential,
-        'average_differential': avg_differential,
-        'time_differential_correlation': correlation,
+        **stats.summary(),
     }
     print(game_analysis)
     return game_analysis
 
+@task
+def update_season_stats(game_data, state_dir=ANALYSIS_STATE_DIR):
+    '''This task will add new games to the saved statistics of each team and season and return the season and all-season analysis.'''
+    
+    # Group the games by their team/season partition
+    games_by_season = {}
+    for game in game_data.select(['team', 'season', 'game_id', 'game_time_in_minutes', 'score_differential']).to_pylist():
+        games_by_season.setdefault((game['team'], game['season']), []).append(game)
+    
+    season_analysis = {}
+    for (team, season), games in games_by_season.items():
+        # Only new games, and games whose missing game time is now known, change the saved state
+        state_path = season_state_path(team, season, state_dir)
+        stats = GameStats.load(state_path)
+        changed_games = stats.add_games(games)
+        if changed_games:
+            stats.save(state_path)
+        
+        print(f"Added or corrected {changed_games} games in the {season} {team} statistics")
+        season_analysis[f"{team}-{season}"] = {'games': len(stats.game_ids), **stats.summary()}
+    
+    # Roll the saved seasons of each team up by merging their states
+    for team in {team for team, _ in games_by_season}:
+        rollup = rollup_season_stats(teams=[team], state_dir=state_dir)
+        season_analysis[f"{team}-all"] = {'games': len(rollup.game_ids), **rollup.summary()}
+    
+    print(season_analysis)
+    return season_analysis
+
 @task
 def save_analysis_to_file(game_analysis, file_name):
     '''This task will save the analysis to a file.'''
     
     # Method 1: Single row format
     df = pd.DataFrame([game_analysis])
-    df.to_parquet(file_name)
+    
+    # Write to a temporary name first, so compaction never picks up a half written file
+    write_atomically(file_name, df.to_parquet)
     
     print(file_name)
     return file_name
 
 @task
-def game_analysis_artifact(game_analysis, game_data_path):
-    '''This task will create an artifact with the game analysis.'''
+def game_analysis_artifact(game_analysis, game_data, data_path=None, top_n=ARTIFACT_TOP_N):
+    '''This task will create an artifact with the game analysis and the longest and shortest games.'''
     
-    # First read the JSON data from the file
-    with open(game_data_path, 'r') as f:
-        game_data = json.load(f)
+    # Only the top and bottom games are rendered, so the artifact size doesn't grow with the number of games
+    columns = ['game_id', 'game_date', 'home_team', 'away_team', 'home_score', 'away_score', 'game_time', 'game_time_in_minutes']
+    timed_games = game_data.filter(pc.is_valid(game_data.column('game_time_in_minutes'))).select(columns)
+    longest_games = timed_games.sort_by([('game_time_in_minutes', 'descending')]).slice(0, top_n).to_pandas()
+    shortest_games = timed_games.sort_by([('game_time_in_minutes', 'ascending')]).slice(0, top_n).to_pandas()
     
-    # Now create the DataFrame from the loaded data
-    df = pd.DataFrame(game_data)
+    if data_path:
+        full_dataset = f"All {game_data.num_rows} games are stored in the Parquet dataset at `{data_path}`, partitioned by team and season."
+    else:
+        full_dataset = f"The full dataset of {game_data.num_rows} games was not persisted; run the flow with persist_raw_data=True to keep it."
     
     # Create the markdown report
     markdown_report=f""" # Game Analysis Report
@@ -178,8 +241,14 @@ Median differential: {game_analysis['median_differential']:.2f}
 Average differential: {game_analysis['average_differential']:.2f}
 Correlation between game time and score differential: {game_analysis['time_differential_correlation']:.2f}
 
-## Raw Data
-{df.to_markdown(index=False)}
+## Longest {len(longest_games)} Games
+{longest_games.to_markdown(index=False)}
+
+## Shortest {len(shortest_games)} Games
+{shortest_games.to_markdown(index=False)}
+
+## Full Dataset
+{full_dataset}
 
 """
     create_markdown_artifact(
@@ -190,33 +259,37 @@ Correlation between game time and score differential: {game_analysis['time_diffe
 
 
 @flow
-def mlb_flow(team_name, start_date, end_date):
+def mlb_flow(team_name, start_date, end_date, max_concurrency=MAX_CONCURRENT_REQUESTS, persist_raw_data=False):
     # Get recent games
     game_ids = get_recent_games(team_name, start_date, end_date)
     
-    # Fetch boxscore for each game
-    game_data = [fetch_single_game_boxscore(game_id, start_date, end_date, team_name) for game_id in game_ids]
-    
-    #Define file path for raw data
-    today = datetime.now().strftime("%Y-%m-%d") #YYYY-MM-DD
-    flow_run_name = runtime.flow_run.name
-    raw_file_path = f"./raw_data/{today}-{team_name}-{flow_run_name}-boxscore.json"
-    
-    # Save raw data to a local folder
-    save_raw_data_to_file(game_data, raw_file_path)
+    # Fetch boxscores for all games concurrently
+    game_data = fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency)
     
     # Clean the time value
-    clean_data = clean_time_value(raw_file_path)
+    clean_data = clean_time_value(game_data)
+    
+    # Only write the games to the partitioned store in a local folder when asked to keep them
+    raw_data_path = None
+    if persist_raw_data:
+        raw_data_path = save_raw_data_to_store(clean_data, start_date, end_date)
+        # Analyze what the store holds for the range, which includes games written by earlier runs
+        clean_data = load_raw_data_from_store(team_name, start_date, end_date, raw_data_path)
     
     # Analyze the results
-    results = analyze_games(clean_data)
+    results = analyze_games(clean_data, team_name, start_date, end_date)
+    
+    # Keep the running statistics of each season up to date
+    update_season_stats(clean_data)
     
     # Save the results to a file
+    today = datetime.now().strftime("%Y-%m-%d") #YYYY-MM-DD
+    flow_run_name = runtime.flow_run.name
     parquet_file_path = f"./boxscore_parquet/{today}-{team_name}-{flow_run_name}-game-analysis.parquet"
     save_analysis_to_file(results, parquet_file_path)
     
     # Save the results to an artifact
-    game_analysis_artifact(results, clean_data)
+    game_analysis_artifact(results, clean_data, raw_data_path)
     
     
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+# raw_game_store.py
+
+import os
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+RAW_DATA_DIR = "./raw_data/games"
+
+# Stable schema for every game record in the store. game_time_in_minutes and
+# delay_minutes stay null until clean_time_value has parsed game_time; team
+# and season are the partition keys.
+RAW_GAME_SCHEMA = pa.schema(
+    [
+        ("search_start_date", pa.string()),
+        ("search_end_date", pa.string()),
+        ("chosen_team_name", pa.string()),
+        ("game_id", pa.int64()),
+        ("game_date", pa.date32()),
+        ("home_team", pa.string()),
+        ("away_team", pa.string()),
+        ("home_score", pa.int64()),
+        ("away_score", pa.int64()),
+        ("score_differential", pa.int64()),
+        ("game_time", pa.string()),
+        ("game_time_in_minutes", pa.int64()),
+        ("delay_minutes", pa.int64()),
+        ("team", pa.string()),
+        ("season", pa.int32()),
+    ]
+)
+
+# Hive style directories, e.g. raw_data/games/team=marlins/season=2024/
+PARTITIONING = ds.partitioning(
+    pa.schema([("team", pa.string()), ("season", pa.int32())]), flavor="hive"
+)
+
+
+def parse_search_date(search_date: str) -> date:
+    """Search dates use the statsapi format, e.g. 06/01/2024."""
+    return datetime.strptime(search_date, "%m/%d/%Y").date()
+
+
+def window_basename(start_date: str, end_date: str) -> str:
+    """File name for one search window, so rerunning a window replaces its files."""
+    start, end = parse_search_date(start_date), parse_search_date(end_date)
+    return f"{start:%Y%m%d}-{end:%Y%m%d}"
+
+
+def games_to_table(game_data: List[Dict]) -> pa.Table:
+    """Convert game records to a table with the store's schema."""
+    rows = []
+    for game in game_data:
+        game_date = game["game_date"]
+        if isinstance(game_date, str):
+            game_date = date.fromisoformat(game_date)
+        rows.append(
+            {
+                **game,
+                "game_date": game_date,
+                "team": game["chosen_team_name"].lower(),
+                "season": game_date.year,
+            }
+        )
+    return pa.Table.from_pylist(rows, schema=RAW_GAME_SCHEMA)
+
+
+def write_games(
+    table: pa.Table, start_date: str, end_date: str, base_dir: str = RAW_DATA_DIR
+) -> str:
+    """
+    Write games into their team/season partitions and return the dataset path.
+
+    Files are named after the search window, so writing the same window again
+    replaces its files while other windows' files are left alone.
+    """
+    ds.write_dataset(
+        table,
+        base_dir,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"{window_basename(start_date, end_date)}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    return base_dir
+
+
+def latest_per_game(table: pa.Table) -> pa.Table:
+    """Keep one row per game when windows overlap, preferring cleaned rows."""
+    keep = {}
+    game_ids = table.column("game_id").to_pylist()
+    cleaned = table.column("game_time_in_minutes").is_valid().to_pylist()
+    for index, (game_id, is_cleaned) in enumerate(zip(game_ids, cleaned)):
+        if game_id not in keep or is_cleaned:
+            keep[game_id] = index
+    return table.take(pa.array(sorted(keep.values()), pa.int64()))
+
+
+def read_games(
+    team_name: str,
+    start_date: str,
+    end_date: str,
+    columns: Optional[List[str]] = None,
+    base_dir: str = RAW_DATA_DIR,
+) -> pa.Table:
+    """
+    Read one team's games for a search window.
+
+    The team and season filters prune whole partitions and the game date
+    filter is pushed down to the Parquet row group statistics, so only the
+    data for the window is read.
+    """
+    if not os.path.isdir(base_dir):
+        return RAW_GAME_SCHEMA.empty_table()
+
+    start, end = parse_search_date(start_date), parse_search_date(end_date)
+    dataset = ds.dataset(
+        base_dir, format="parquet", schema=RAW_GAME_SCHEMA, partitioning=PARTITIONING
+    )
+    games_filter = (
+        (ds.field("team") == team_name.lower())
+        & ds.field("season").isin(list(range(start.year, end.year + 1)))
+        & (ds.field("game_date") >= pa.scalar(start, pa.date32()))
+        & (ds.field("game_date") <= pa.scalar(end, pa.date32()))
+    )
+    table = latest_per_game(dataset.to_table(filter=games_filter))
+    return table.select(columns) if columns else table
@@ -1,14 +1,18 @@
 from prefect import flow, task, runtime
 from prefect.artifacts import create_markdown_artifact
-from prefect_aws.s3 import S3Bucket
-from prefect.blocks.system import Secret
 from datetime import datetime
 import statsapi
+import asyncio
+import httpx
 import json
 import pandas as pd
-import duckdb
+from object_store import get_object_store
+from duckdb_loader import DUCKDB_DATABASE, analysis_table, motherduck_database, upsert_analysis
 import random
 
+MLB_GAME_FEED_URL = "https://statsapi.mlb.com/api/v1.1/game/{game_id}/feed/live"
+MAX_CONCURRENT_REQUESTS = 10
+
 #The retry_delay_seconds option accepts a list of integers for customized retry behavior
 #This task will retry 10 times with a delay of 1 second each time
 @task(retries=10, retry_delay_seconds=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
@@ -24,65 +28,78 @@ def get_recent_games(team_name, start_date, end_date):
         print(game['game_id'])
     return [game['game_id'] for game in schedule]
 
-@task
-def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
-    '''This task will fetch the boxscore for a single game and return the game data.'''
-    boxscore = statsapi.boxscore_data(game_id)
-    
-    # Extract relevant data
-    home_score = boxscore['home']['teamStats']['batting']['runs']
-    away_score = boxscore['away']['teamStats']['batting']['runs']
-    home_team = boxscore['teamInfo']['home']['teamName']
-    away_team = boxscore['teamInfo']['away']['teamName']
-    time_value = next(item['value'] for item in boxscore['gameBoxInfo'] if item['label'] == 'T')
-    
-    #Create a dictionary with the game data
-    game_data = {
-        'search_start_date': start_date,
-        'search_end_date': end_date,
-        'chosen_team_name': team_name,
-        'game_id': game_id,
-        'home_team': home_team,
-        'away_team': away_team,
-        'home_score': home_score,
-        'away_score': away_score,
-        'score_differential': abs(home_score - away_score),
-        'game_time': time_value,
-    }
-    
-    print(game_data)
-    return game_data
+async def fetch_game_feed(client, semaphore, game_id):
+    '''Fetch the live feed for a single game once a request slot is free.'''
+    async with semaphore:
+        response = await client.get(MLB_GAME_FEED_URL.format(game_id=game_id))
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_game_feeds(game_ids, max_concurrency):
+    '''Fetch the live feeds for all games over a single pooled HTTP client.'''
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        # gather returns the feeds in the same order as the game ids
+        return await asyncio.gather(*(fetch_game_feed(client, semaphore, game_id) for game_id in game_ids))
 
 
 @task
-def save_raw_data_to_file(game_data, file_name):
-    '''This task will save the raw data to a file.'''
-    
-    with open(file_name, "w") as outfile:
-        json.dump(game_data, outfile, indent=4, sort_keys=True)
-    
-    print(file_name)
-    return file_name
-        
-        
+def fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    '''This task will fetch the boxscores for all games concurrently and return the game data.'''
+    feeds = asyncio.run(fetch_game_feeds(game_ids, max_concurrency))
+
+    all_game_data = []
+    for game_id, feed in zip(game_ids, feeds):
+        boxscore = feed['liveData']['boxscore']
+        teams = feed['gameData']['teams']
+
+        # Extract relevant data
+        home_score = boxscore['teams']['home']['teamStats']['batting']['runs']
+        away_score = boxscore['teams']['away']['teamStats']['batting']['runs']
+        home_team = teams['home']['teamName']
+        away_team = teams['away']['teamName']
+        time_value = next(item['value'] for item in boxscore['info'] if item['label'] == 'T')
+
+        #Create a dictionary with the game data
+        game_data = {
+            'search_start_date': start_date,
+            'search_end_date': end_date,
+            'chosen_team_name': team_name,
+            'game_id': game_id,
+            'home_team': home_team,
+            'away_team': away_team,
+            'home_score': home_score,
+            'away_score': away_score,
+            'score_differential': abs(home_score - away_score),
+            'game_time': time_value,
+        }
+
+        print(game_data)
+        all_game_data.append(game_data)
+
+    return all_game_data
+
+
 @task
-def upload_raw_data_to_s3(file_path):
-    '''This task will upload the raw data to s3.'''
+def upload_raw_data_to_s3(game_data, s3_file_path):
+    '''This task will stream the raw data to s3 without writing a local file.'''
     
-    s3_bucket = S3Bucket.load("mlb-raw-data")
-    s3_bucket_path = s3_bucket.upload_from_path(file_path)
+    object_store = get_object_store("mlb-raw-data")
+    s3_bucket_path = object_store.put_json(s3_file_path, game_data)
     
     print(s3_bucket_path)
-    return s3_bucket_path
+    return s3_file_path
     
 
 @task
 def download_raw_data_from_s3(s3_file_path):
-    '''Download the raw data from s3.'''
+    '''Download the raw data from s3, reusing the local cached copy when it is still current.'''
     
-    s3_bucket = S3Bucket.load("mlb-raw-data")
+    object_store = get_object_store("mlb-raw-data")
     local_file_path = f"./boxscore_analysis/{s3_file_path}"
-    s3_bucket.download_object_to_path(s3_file_path, local_file_path)
+    object_store.download(s3_file_path, local_file_path)
     
     return local_file_path
 
@@ -220,52 +237,33 @@ Correlation between game time and score differential: {game_analysis['time_diffe
     )
     
 @task
-def load_parquet_to_duckdb(parquet_file_path, team_name):
-    '''This task will load the parquet file to duckdb.'''
-    
-    #Connect to duckdb
-    secret_block = Secret.load("mother-duck-test")
-    # Access the stored secret
-    duck_token = secret_block.get()
-    duckdb_conn = duckdb.connect(f"md:?motherduck_token={duck_token}")
-    
-    #Create a table in duckdb
-    duckdb_conn.execute(f"""CREATE TABLE IF NOT EXISTS boxscore_analysis_{team_name} (
-        search_start_date TEXT, 
-        search_end_date TEXT, 
-        chosen_team_name TEXT, 
-        max_game_time FLOAT, 
-        min_game_time FLOAT, 
-        median_game_time FLOAT, 
-        average_game_time FLOAT, 
-        max_differential FLOAT, 
-        min_differential FLOAT, 
-        median_differential FLOAT, 
-        average_differential FLOAT, 
-        time_differential_correlation FLOAT)""")
-    
-    # Use the COPY command to load the Parquet file into MotherDuck
-    duckdb_conn.execute(f"COPY boxscore_analysis FROM '{parquet_file_path}' (FORMAT 'parquet')")
+def load_analysis_to_duckdb(game_analysis, database=DUCKDB_DATABASE):
+    '''This task will upsert the analysis into duckdb, replacing an earlier run for the same team and search window.'''
+    
+    #Connect to MotherDuck unless a local duckdb database is configured
+    if database is None:
+        database = motherduck_database("mother-duck-test")
+    
+    # Register the analysis as an Arrow table and upsert it in one transaction
+    rows = upsert_analysis(analysis_table([game_analysis]), database)
+    print(f"Loaded {rows} analysis rows to duckdb")
 
 
 @flow
-def mlb_flow(team_name, start_date, end_date):
+def mlb_flow(team_name, start_date, end_date, max_concurrency=MAX_CONCURRENT_REQUESTS):
     # Get recent games
     game_ids = get_recent_games(team_name, start_date, end_date)
     
-    # Fetch boxscore for each game
-    game_data = [fetch_single_game_boxscore(game_id, start_date, end_date, team_name) for game_id in game_ids]
+    # Fetch boxscores for all games concurrently
+    game_data = fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency)
     
     #Define file path for raw data
     today = datetime.now().strftime("%Y-%m-%d") #YYYY-MM-DD
     flow_run_name = runtime.flow_run.name
-    raw_file_path = f"./raw_data/{today}-{team_name}-{flow_run_name}-boxscore.json"
-    
-    # Save raw data to a local folder
-    save_raw_data_to_file(game_data, raw_file_path)
+    s3_file_path = f"{today}-{team_name}-{flow_run_name}-boxscore.json"
     
     # Upload raw data to s3
-    s3_file_path = upload_raw_data_to_s3(raw_file_path)
+    s3_file_path = upload_raw_data_to_s3(game_data, s3_file_path)
     
     #Download raw data from s3
     raw_data = download_raw_data_from_s3(s3_file_path)
@@ -281,7 +279,7 @@ def mlb_flow(team_name, start_date, end_date):
     save_analysis_to_file(results, parquet_file_path)
     
     # Load the results to duckdb
-    load_parquet_to_duckdb(parquet_file_path, team_name)
+    load_analysis_to_duckdb(results)
     
     # Save the results to an artifact
     game_analysis_artifact(results, raw_data)
@@ -0,0 +1,227 @@
+# object_store.py
+
+import functools
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+# Point at a local S3 stand-in such as MinIO or a moto server, e.g. http://localhost:9000
+S3_ENDPOINT_URL = os.environ.get("MLB_S3_ENDPOINT_URL")
+OBJECT_CACHE_DIR = os.environ.get("MLB_OBJECT_CACHE_DIR", "./.object_cache")
+# Downloaded objects beyond this size are evicted, least recently used first
+OBJECT_CACHE_MAX_BYTES = int(os.environ.get("MLB_OBJECT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Uploads larger than one part are sent as a multipart upload in parts of this size
+MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _parts(pieces: Iterable[bytes], part_bytes: int = MULTIPART_CHUNK_BYTES) -> Iterator[bytes]:
+    """Regroup a stream of byte pieces into parts of part_bytes; only the last one is smaller."""
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= part_bytes:
+            yield bytes(buffer[:part_bytes])
+            del buffer[:part_bytes]
+    if buffer:
+        yield bytes(buffer)
+
+
+class ObjectStore:
+    """
+    S3 bucket with a local content-addressed cache of downloaded objects.
+
+    Uploads are streamed to S3 one part at a time and leave nothing on disk.
+    Downloaded objects are cached under their SHA-256 and every key remembers
+    the ETag its cached copy was read with. A download sends the ETag as
+    If-None-Match, so an object we already hold costs one request that
+    returns no body. The cache is bounded by max_bytes and evicts the least
+    recently used objects.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket_name: str,
+        prefix: str = "",
+        cache_dir: str = OBJECT_CACHE_DIR,
+        max_bytes: int = OBJECT_CACHE_MAX_BYTES,
+    ):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "keys"), exist_ok=True)
+
+    @classmethod
+    def from_block(cls, block_name: str, cache_dir: str = OBJECT_CACHE_DIR) -> "ObjectStore":
+        """Build a store from an S3Bucket block, honoring MLB_S3_ENDPOINT_URL."""
+        from prefect_aws.s3 import S3Bucket
+
+        s3_bucket = S3Bucket.load(block_name)
+        if S3_ENDPOINT_URL:
+            client = s3_bucket.credentials.get_boto3_session().client("s3", endpoint_url=S3_ENDPOINT_URL)
+        else:
+            client = s3_bucket.credentials.get_s3_client()
+        return cls(client, s3_bucket.bucket_name, s3_bucket.bucket_folder, cache_dir)
+
+    def key(self, path: str) -> str:
+        return f"{self.prefix}/{path}" if self.prefix else path
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, "objects", sha256)
+
+    def _key_path(self, key: str) -> str:
+        name = hashlib.sha256(f"{self.bucket_name}/{key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "keys", f"{name}.json")
+
+    def _cached(self, key: str) -> Optional[Dict]:
+        """ETag and content hash of the cached copy of key, if we still hold it."""
+        key_path = self._key_path(key)
+        try:
+            with open(key_path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            # Mark the object as recently used, so eviction keeps it
+            os.utime(self._object_path(entry["sha256"]))
+        except FileNotFoundError:
+            # The object was evicted; forget the key too
+            try:
+                os.remove(key_path)
+            except FileNotFoundError:
+                pass
+            return None
+        return entry
+
+    def _remember(self, key: str, etag: str, sha256: str) -> None:
+        key_path = self._key_path(key)
+        temp_path = f"{key_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"key": key, "etag": etag, "sha256": sha256}, f)
+        os.replace(temp_path, key_path)
+
+    def _add_to_cache(self, fileobj) -> str:
+        """Copy a downloaded body into the cache and return its content hash."""
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(MULTIPART_CHUNK_BYTES), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        # Identical content is stored once, whatever key it was written under
+        os.replace(temp_path, self._object_path(sha256))
+        self._evict()
+        return sha256
+
+    def _evict(self) -> None:
+        """Remove the least recently used objects until the cache fits in max_bytes."""
+        objects_dir = os.path.join(self.cache_dir, "objects")
+        with self._lock:
+            objects = []
+            for entry in os.scandir(objects_dir):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in objects)
+            # The newest object is the one being read, so it is never evicted
+            for _, size, path in sorted(objects)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _upload_parts(self, parts: Iterable[bytes], path: str) -> str:
+        """Upload parts of MULTIPART_CHUNK_BYTES as one object, multipart when there is more than one; returns the key."""
+        key = self.key(path)
+        parts = iter(parts)
+        first = next(parts, b"")
+        second = next(parts, None)
+        if second is None:
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=first)
+            return key
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key)["UploadId"]
+        try:
+            uploaded = []
+            for number, part in enumerate(itertools.chain([first, second], parts), start=1):
+                response = self.client.upload_part(
+                    Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=number, Body=part
+                )
+                uploaded.append({"PartNumber": number, "ETag": response["ETag"]})
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": uploaded}
+            )
+        except Exception:
+            # Don't leave the parts behind in the bucket
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            raise
+        return key
+
+    def upload_fileobj(self, fileobj, path: str) -> str:
+        """Stream a file object to S3 and return its key."""
+        return self._upload_parts(_parts(iter(lambda: fileobj.read(MULTIPART_CHUNK_BYTES), b"")), path)
+
+    def upload_file(self, local_path: str, path: Optional[str] = None) -> str:
+        """Upload a local file, by default under its file name."""
+        with open(local_path, "rb") as f:
+            return self.upload_fileobj(f, path or os.path.basename(local_path))
+
+    def put_json(self, path: str, data: Any) -> str:
+        """Serialize data as JSON straight into an upload, one part in memory at a time."""
+        pieces = json.JSONEncoder(indent=4, sort_keys=True).iterencode(data)
+        return self._upload_parts(_parts(piece.encode("utf-8") for piece in pieces), path)
+
+    def cached_path(self, path: str) -> str:
+        """Local path of an up to date copy of the object, downloading it only if it changed."""
+        key = self.key(path)
+        entry = self._cached(key)
+
+        request = {"Bucket": self.bucket_name, "Key": key}
+        if entry is not None:
+            request["IfNoneMatch"] = entry["etag"]
+        try:
+            response = self.client.get_object(**request)
+        except ClientError as e:
+            # 304 Not Modified: our cached copy is still current
+            if entry is not None and e.response["Error"]["Code"] in ("304", "NotModified"):
+                return self._object_path(entry["sha256"])
+            raise
+
+        sha256 = self._add_to_cache(response["Body"])
+        self._remember(key, response["ETag"], sha256)
+        return self._object_path(sha256)
+
+    def get_json(self, path: str) -> Any:
+        with open(self.cached_path(path), "r") as f:
+            return json.load(f)
+
+    def download(self, path: str, local_path: str) -> str:
+        """Copy the object to local_path; the copy can be modified without touching the cache."""
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        shutil.copyfile(self.cached_path(path), local_path)
+        return local_path
+
+
+@functools.lru_cache(maxsize=None)
+def get_object_store(block_name: str) -> ObjectStore:
+    """One store per S3Bucket block and process, so tasks share its client."""
+    return ObjectStore.from_block(block_name)
@@ -0,0 +1,116 @@
+# duckdb_loader.py
+
+import os
+import threading
+from typing import Dict, List
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from prefect.blocks.system import Secret
+
+# Point this at a local file (e.g. ./mlb.duckdb) to load into DuckDB instead of MotherDuck
+DUCKDB_DATABASE = os.environ.get("MLB_DUCKDB_DATABASE")
+
+ANALYSIS_TABLE = "boxscore_game_analysis"
+
+# One row per team and search window; a rerun of the same window replaces its row
+KEY_COLUMNS = ["chosen_team_name", "search_start_date", "search_end_date"]
+
+ANALYSIS_COLUMNS = [
+    ("search_start_date", "TEXT", pa.string()),
+    ("search_end_date", "TEXT", pa.string()),
+    ("chosen_team_name", "TEXT", pa.string()),
+    ("max_game_time", "FLOAT", pa.float32()),
+    ("min_game_time", "FLOAT", pa.float32()),
+    ("median_game_time", "FLOAT", pa.float32()),
+    ("average_game_time", "FLOAT", pa.float32()),
+    ("max_differential", "FLOAT", pa.float32()),
+    ("min_differential", "FLOAT", pa.float32()),
+    ("median_differential", "FLOAT", pa.float32()),
+    ("average_differential", "FLOAT", pa.float32()),
+    ("time_differential_correlation", "FLOAT", pa.float32()),
+]
+ANALYSIS_SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type in ANALYSIS_COLUMNS])
+
+_connections: Dict[str, duckdb.DuckDBPyConnection] = {}
+_connections_lock = threading.Lock()
+
+
+def motherduck_database(secret_block_name: str) -> str:
+    """MotherDuck connection string using the token stored in a Secret block."""
+    duck_token = Secret.load(secret_block_name).get()
+    return f"md:?motherduck_token={duck_token}"
+
+
+def get_connection(database: str) -> duckdb.DuckDBPyConnection:
+    """
+    Cursor on the process-wide connection for database.
+
+    The connection (and the analysis table) is set up once per process.
+    Each call gets its own cursor, which shares that connection but can be
+    used from a different task thread.
+    """
+    with _connections_lock:
+        if database not in _connections:
+            connection = duckdb.connect(database)
+            columns = ", ".join(f"{name} {sql_type}" for name, sql_type, _ in ANALYSIS_COLUMNS)
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {ANALYSIS_TABLE} ({columns}, PRIMARY KEY ({', '.join(KEY_COLUMNS)}))"
+            )
+            _connections[database] = connection
+        return _connections[database].cursor()
+
+
+def analysis_table(analyses: List[Dict]) -> pa.Table:
+    """Arrow table of analyze_games results in the loader's schema."""
+    return pa.Table.from_pylist(analyses, schema=ANALYSIS_SCHEMA)
+
+
+def latest_per_key(analysis: pa.Table) -> pa.Table:
+    # A single INSERT can't update the same row twice, so keep the last row per key
+    keys = zip(*(analysis.column(name).to_pylist() for name in KEY_COLUMNS))
+    keep = {key: index for index, key in enumerate(keys)}
+    return analysis.take(sorted(keep.values()))
+
+
+def upsert_analysis(analysis: pa.Table, database: str) -> int:
+    """
+    Upsert analysis rows into ANALYSIS_TABLE in one transaction.
+
+    The Arrow table is registered with DuckDB without copying it. Rows for a
+    team and search window that is already loaded replace the existing row.
+    Returns the number of rows written.
+    """
+    analysis = latest_per_key(analysis.select(ANALYSIS_SCHEMA.names).cast(ANALYSIS_SCHEMA))
+    columns = ", ".join(ANALYSIS_SCHEMA.names)
+    updates = ", ".join(
+        f"{name} = EXCLUDED.{name}" for name in ANALYSIS_SCHEMA.names if name not in KEY_COLUMNS
+    )
+
+    connection = get_connection(database)
+    connection.register("analysis_batch", analysis)
+    try:
+        connection.execute("BEGIN TRANSACTION")
+        connection.execute(
+            f"""INSERT INTO {ANALYSIS_TABLE} ({columns})
+            SELECT {columns} FROM analysis_batch
+            ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}"""
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.unregister("analysis_batch")
+        connection.close()
+
+    return analysis.num_rows
+
+
+def load_analysis_files(parquet_file_paths: List[str], database: str) -> int:
+    """Load many runs' analysis Parquet files in a single transaction, e.g. for a backfill."""
+    tables = [pq.read_table(path) for path in parquet_file_paths]
+    if not tables:
+        return 0
+    return upsert_analysis(pa.concat_tables(tables, promote_options="default"), database)
@@ -1,13 +1,16 @@
 from prefect import flow, task, runtime
 from prefect.artifacts import create_markdown_artifact
-from prefect_aws.s3 import S3Bucket
 from prefect.blocks.system import Secret
 from datetime import datetime
 import statsapi
-import json
+import asyncio
+import httpx
 import pandas as pd
 import duckdb
-from io import BytesIO
+from object_store import get_object_store
+
+MLB_GAME_FEED_URL = "https://statsapi.mlb.com/api/v1.1/game/{game_id}/feed/live"
+MAX_CONCURRENT_REQUESTS = 10
     
 
 @task
@@ -20,64 +23,76 @@ def get_recent_games(team_name, start_date, end_date):
     return [game['game_id'] for game in schedule]
 
 
+async def fetch_game_feed(client, semaphore, game_id):
+    '''Fetch the live feed for a single game once a request slot is free.'''
+    async with semaphore:
+        response = await client.get(MLB_GAME_FEED_URL.format(game_id=game_id))
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_game_feeds(game_ids, max_concurrency):
+    '''Fetch the live feeds for all games over a single pooled HTTP client.'''
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        # gather returns the feeds in the same order as the game ids
+        return await asyncio.gather(*(fetch_game_feed(client, semaphore, game_id) for game_id in game_ids))
+
+
 @task
-def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
-    '''This task will fetch the boxscore for a single game and return the game data.'''
-    boxscore = statsapi.boxscore_data(game_id)
-    rows = []
-    
-    # Extract relevant data
-    home_score = boxscore['home']['teamStats']['batting']['runs']
-    away_score = boxscore['away']['teamStats']['batting']['runs']
-    home_team = boxscore['teamInfo']['home']['teamName']
-    away_team = boxscore['teamInfo']['away']['teamName']
-    time_value = next(item['value'] for item in boxscore['gameBoxInfo'] if item['label'] == 'T')
-    
-    #Create a dictionary with the game data
-    game_data = {
-        'search_start_date': start_date,
-        'search_end_date': end_date,
-        'chosen_team_name': team_name,
-        'game_id': game_id,
-        'home_team': home_team,
-        'away_team': away_team,
-        'home_score': home_score,
-        'away_score': away_score,
-        'score_differential': abs(home_score - away_score),
-        'game_time': time_value,
-    }
-    
-    print(game_data)
-    return game_data
+def fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    '''This task will fetch the boxscores for all games concurrently and return the game data.'''
+    feeds = asyncio.run(fetch_game_feeds(game_ids, max_concurrency))
+
+    all_game_data = []
+    for game_id, feed in zip(game_ids, feeds):
+        boxscore = feed['liveData']['boxscore']
+        teams = feed['gameData']['teams']
+
+        # Extract relevant data
+        home_score = boxscore['teams']['home']['teamStats']['batting']['runs']
+        away_score = boxscore['teams']['away']['teamStats']['batting']['runs']
+        home_team = teams['home']['teamName']
+        away_team = teams['away']['teamName']
+        time_value = next(item['value'] for item in boxscore['info'] if item['label'] == 'T')
+
+        #Create a dictionary with the game data
+        game_data = {
+            'search_start_date': start_date,
+            'search_end_date': end_date,
+            'chosen_team_name': team_name,
+            'game_id': game_id,
+            'home_team': home_team,
+            'away_team': away_team,
+            'home_score': home_score,
+            'away_score': away_score,
+            'score_differential': abs(home_score - away_score),
+            'game_time': time_value,
+        }
+
+        print(game_data)
+        all_game_data.append(game_data)
+
+    return all_game_data
 
 
 @task
 def upload_raw_data_to_s3(game_data, s3_file_path):
-    '''This task will upload the raw data directly to s3 without creating a local file.'''
-    # Convert data to JSON bytes
-    json_data = json.dumps(game_data, indent=4, sort_keys=True).encode('utf-8')
-    buffer = BytesIO(json_data)
+    '''This task will stream the raw data directly to s3 without creating a local file.'''
     
-    s3_bucket = S3Bucket.load("mlb-raw-data")
-    s3_bucket_path = s3_bucket.upload_from_file_object(buffer, to_path=s3_file_path)
+    object_store = get_object_store("mlb-raw-data")
+    s3_bucket_path = object_store.put_json(s3_file_path, game_data)
     print(s3_bucket_path)
-    return s3_bucket_path
+    return s3_file_path
     
 
 @task
 def download_raw_data_from_s3(s3_file_path):
-    '''Download the raw data directly from s3 into memory.'''
-    
-    s3_bucket = S3Bucket.load("mlb-raw-data")
-    buffer = BytesIO()
-    s3_bucket.download_object_to_file_object(s3_file_path, buffer)
+    '''Load the raw data from s3, skipping the download when the cached copy is still current.'''
     
-    # Reset buffer position to start
-    buffer.seek(0)
-    # Parse JSON data from buffer
-    game_data = json.loads(buffer.read().decode('utf-8'))
-    
-    return game_data
+    object_store = get_object_store("mlb-raw-data")
+    return object_store.get_json(s3_file_path)
 
 @task
 def clean_time_value(game_data):
@@ -214,12 +229,12 @@ def load_df_to_duckdb(analysis_df, team_name):
 
 
 @flow
-def mlb_flow(team_name, start_date, end_date):
+def mlb_flow(team_name, start_date, end_date, max_concurrency=MAX_CONCURRENT_REQUESTS):
     # Get recent games
     game_ids = get_recent_games(team_name, start_date, end_date)
     
-    # Fetch boxscore for each game
-    game_data = [fetch_single_game_boxscore(game_id, start_date, end_date, team_name) for game_id in game_ids]
+    # Fetch boxscores for all games concurrently
+    game_data = fetch_game_boxscores(game_ids, start_date, end_date, team_name, max_concurrency)
     
     #Define file path for raw data
     today = datetime.now().strftime("%Y-%m-%d") #YYYY-MM-DD
@@ -3,11 +3,16 @@ from prefect.artifacts import create_markdown_artifact
 from prefect.transactions import transaction
 from datetime import datetime
 import statsapi
+import asyncio
+import httpx
 import json
 import pandas as pd
 import os
 import time
 
+MLB_GAME_FEED_URL = "https://statsapi.mlb.com/api/v1.1/game/{game_id}/feed/live"
+MAX_CONCURRENT_REQUESTS = 10
+
 @task
 def get_recent_games(team_id, start_date, end_date):
     # Get all games for the provided team and date range
@@ -16,30 +21,52 @@ def get_recent_games(team_id, start_date, end_date):
         print(game['game_id'])
     return [game['game_id'] for game in schedule]
 
+async def fetch_game_feed(client, semaphore, game_id):
+    "Fetch the live feed for a single game once a request slot is free."
+    async with semaphore:
+        response = await client.get(MLB_GAME_FEED_URL.format(game_id=game_id))
+        response.raise_for_status()
+        return response.json()
+
+async def fetch_game_feeds(game_ids, max_concurrency):
+    "Fetch the live feeds for all games over a single pooled HTTP client."
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        # gather returns the feeds in the same order as the game ids
+        return await asyncio.gather(*(fetch_game_feed(client, semaphore, game_id) for game_id in game_ids))
+
 @task
-def fetch_single_game_boxscore(game_id):
-    boxscore = statsapi.boxscore_data(game_id)
-    
-    # Extract relevant data
-    home_score = boxscore['home']['teamStats']['batting']['runs']
-    away_score = boxscore['away']['teamStats']['batting']['runs']
-    home_team = boxscore['teamInfo']['home']['teamName']
-    away_team = boxscore['teamInfo']['away']['teamName']
-    time_value = next(item['value'] for item in boxscore['gameBoxInfo'] if item['label'] == 'T')
-    
-    #Create a dictionary with the game data
-    game_data = {
-        'game_id': game_id,
-        'home_team': home_team,
-        'away_team': away_team,
-        'home_score': home_score,
-        'away_score': away_score,
-        'score_differential': abs(home_score - away_score),
-        'game_time': time_value,
-    }
+def fetch_game_boxscores(game_ids, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    feeds = asyncio.run(fetch_game_feeds(game_ids, max_concurrency))
     
-    print(game_data)
-    return game_data
+    all_game_data = []
+    for game_id, feed in zip(game_ids, feeds):
+        boxscore = feed['liveData']['boxscore']
+        teams = feed['gameData']['teams']
+        
+        # Extract relevant data
+        home_score = boxscore['teams']['home']['teamStats']['batting']['runs']
+        away_score = boxscore['teams']['away']['teamStats']['batting']['runs']
+        home_team = teams['home']['teamName']
+        away_team = teams['away']['teamName']
+        time_value = next(item['value'] for item in boxscore['info'] if item['label'] == 'T')
+        
+        #Create a dictionary with the game data
+        game_data = {
+            'game_id': game_id,
+            'home_team': home_team,
+            'away_team': away_team,
+            'home_score': home_score,
+            'away_score': away_score,
+            'score_differential': abs(home_score - away_score),
+            'game_time': time_value,
+        }
+        
+        print(game_data)
+        all_game_data.append(game_data)
+    
+    return all_game_data
 
 @task
 def clean_time_value(game_data):
@@ -156,12 +183,12 @@ Correlation between game time and score differential: {game_analysis['time_diffe
 
 
 @flow
-def mlb_flow_rollback(team_id, start_date, end_date):
+def mlb_flow_rollback(team_id, start_date, end_date, max_concurrency=MAX_CONCURRENT_REQUESTS):
     # Get recent games
     game_ids = get_recent_games(team_id, start_date, end_date)
     
-    # Fetch boxscore for each game
-    game_data = [fetch_single_game_boxscore(game_id) for game_id in game_ids]
+    # Fetch boxscores for all games concurrently
+    game_data = fetch_game_boxscores(game_ids, max_concurrency)
     
     #Define file path for raw data
     today = datetime.now().strftime("%Y-%m-%d") #YYYY-MM-DD
@@ -0,0 +1,164 @@
+# cache_metrics.py
+
+import glob
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from prefect.artifacts import create_table_artifact
+
+from atomic_write import write_atomically
+
+CACHE_METRICS_DIR = "./cache_metrics"
+
+POLICY_NAMES = {
+    "Inputs": "INPUTS",
+    "TaskSource": "TASK_SOURCE",
+    "FlowParameters": "FLOW_PARAMETERS",
+    "RunId": "RUN_ID",
+    "Default": "DEFAULT",
+    "_None": "NONE",
+}
+
+
+def describe_policy(policy) -> str:
+    """Short name of a cache policy, e.g. TASK_SOURCE + INPUTS - file_name."""
+    if policy is None:
+        return "NONE"
+    policies = getattr(policy, "policies", None)
+    if policies is not None:
+        return " + ".join(describe_policy(p) for p in policies)
+    name = POLICY_NAMES.get(type(policy).__name__, type(policy).__name__)
+    exclude = getattr(policy, "exclude", None)
+    if exclude:
+        name += "".join(f" - {field}" for field in exclude)
+    return name
+
+
+class _TaskCacheStats:
+    def __init__(self, policy: str, expiration: Optional[str]):
+        self.policy = policy
+        self.expiration = expiration
+        self.hits = 0
+        self.misses = 0
+        self.cold_seconds: List[float] = []
+        self.key_bytes: Dict[str, Optional[int]] = {}
+
+
+class CacheMetrics:
+    """
+    Cache hits and misses of task runs, collected by an on_completion hook.
+
+    Stats are kept per flow run, so flow runs served by the same process
+    don't mix. A run that was not Cached counts as a miss, and its run time
+    as the cold execution time of the task. Time saved is the number of hits
+    times the mean cold time, taken from an earlier report when every run
+    of a task was a hit. Bytes stored is the size of the result records of
+    the distinct cache keys seen; each record is measured once per flow run,
+    the first time its key is seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[str, Dict[str, _TaskCacheStats]] = defaultdict(dict)
+
+    def record(self, task, task_run, state) -> None:
+        """on_completion hook for cached tasks."""
+        record = state.data
+        metadata = getattr(record, "metadata", None)
+        key = getattr(metadata, "storage_key", None)
+        run_time = task_run.total_run_time.total_seconds() if task_run.total_run_time else 0.0
+
+        with self._lock:
+            stats = self._runs[str(task_run.flow_run_id)].get(task.name)
+            if stats is None:
+                expiration = str(task.cache_expiration) if task.cache_expiration else None
+                stats = _TaskCacheStats(describe_policy(task.cache_policy), expiration)
+                self._runs[str(task_run.flow_run_id)][task.name] = stats
+
+            if state.name == "Cached":
+                stats.hits += 1
+            else:
+                stats.misses += 1
+                stats.cold_seconds.append(run_time)
+            measure = key is not None and key not in stats.key_bytes
+            if measure:
+                stats.key_bytes[key] = None
+
+        # Serializing is as costly as the result is large, so each key is measured once
+        if measure and hasattr(record, "serialize"):
+            size = len(record.serialize())
+            with self._lock:
+                stats.key_bytes[key] = size
+
+    def rows(self, flow_run_id: str, metrics_dir: str = CACHE_METRICS_DIR) -> List[Dict]:
+        """One row per task of the flow run; clears the run's stats."""
+        with self._lock:
+            run = self._runs.pop(str(flow_run_id), {})
+        previous_cold_seconds = load_cold_seconds(metrics_dir)
+
+        rows = []
+        for task_name, stats in sorted(run.items()):
+            runs = stats.hits + stats.misses
+            if stats.cold_seconds:
+                cold_seconds = sum(stats.cold_seconds) / len(stats.cold_seconds)
+            else:
+                cold_seconds = previous_cold_seconds.get(task_name)
+            sizes = [size for size in stats.key_bytes.values() if size is not None]
+            rows.append(
+                {
+                    "task": task_name,
+                    "policy": stats.policy,
+                    "expiration": stats.expiration,
+                    "hits": stats.hits,
+                    "misses": stats.misses,
+                    "hit_rate": round(stats.hits / runs, 3) if runs else None,
+                    "mean_cold_seconds": round(cold_seconds, 3) if cold_seconds is not None else None,
+                    "time_saved_seconds": round(stats.hits * cold_seconds, 3) if cold_seconds is not None else None,
+                    "distinct_keys": len(stats.key_bytes),
+                    "bytes_stored": sum(sizes) if sizes else None,
+                }
+            )
+        return rows
+
+    def publish(self, flow_run_id: str, flow_run_name: str, metrics_dir: str = CACHE_METRICS_DIR) -> str:
+        """Write the flow run's cache metrics to a JSON file and a table artifact; returns the file path."""
+        rows = self.rows(flow_run_id, metrics_dir)
+
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = os.path.join(metrics_dir, f"{flow_run_name}.json")
+        report = {"flow_run_id": str(flow_run_id), "flow_run_name": flow_run_name, "tasks": rows}
+
+        def write(temp_path: str) -> None:
+            with open(temp_path, "w") as f:
+                json.dump(report, f, indent=4)
+
+        write_atomically(path, write)
+
+        create_table_artifact(
+            key="cache-metrics",
+            table=rows,
+            description=f"Cache hits, misses and savings per task for {flow_run_name}",
+        )
+        return path
+
+
+def load_cold_seconds(metrics_dir: str = CACHE_METRICS_DIR) -> Dict[str, float]:
+    """Most recently reported mean cold time of each task."""
+    cold_seconds = {}
+    for path in sorted(glob.glob(os.path.join(metrics_dir, "*.json")), key=os.path.getmtime):
+        try:
+            with open(path, "r") as f:
+                report = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        for row in report.get("tasks", []):
+            if row.get("misses") and row.get("mean_cold_seconds") is not None:
+                cold_seconds[row["task"]] = row["mean_cold_seconds"]
+    return cold_seconds
+
+
+CACHE_METRICS = CacheMetrics()
+record_cache_result = CACHE_METRICS.record
@@ -0,0 +1,112 @@
+# cache_policies.py
+
+import functools
+import hashlib
+import mmap
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from prefect.cache_policies import CachePolicy
+from prefect.context import TaskRunContext
+from prefect.utilities.hashing import hash_objects
+
+# Schedule statuses after which a game's boxscore no longer changes. Detailed
+# statuses extend them, e.g. "Final: Tied" or "Completed Early: Rain", so they
+# are matched as prefixes, the same way as is_final_status in mlb_api_cache
+FINAL_GAME_STATUSES = ("Final", "Game Over", "Completed Early")
+
+# Files are hashed in chunks of this size, so large files never sit in memory whole
+CHUNK_BYTES = 1024 * 1024
+
+
+def is_final(game_status: Optional[str]) -> bool:
+    """Check whether a schedule status describes a finished game."""
+    return bool(game_status) and game_status.startswith(FINAL_GAME_STATUSES)
+
+
+@dataclass
+class FinalGameBoxscore(CachePolicy):
+    """
+    Caches a boxscore on its game ID alone, once the game is final.
+
+    The key leaves out the task, the search window and the team, so a game
+    fetched for one date range or team is reused by every other run that
+    includes it. A final boxscore never changes, so it can be cached without
+    an expiration. Games that are not final yet are not cached at all.
+    """
+
+    # Bump to invalidate every cached boxscore, e.g. when the extracted fields change
+    version: int = 1
+
+    def compute_key(
+        self,
+        task_ctx: TaskRunContext,
+        inputs: Dict[str, Any],
+        flow_parameters: Dict[str, Any],
+        **kwargs: Any,
+    ) -> Optional[str]:
+        if not is_final(inputs.get("game_status")):
+            return None
+        return hash_objects("boxscore", self.version, int(inputs["game_id"]))
+
+
+FINAL_GAME_BOXSCORE = FinalGameBoxscore()
+
+
+@functools.lru_cache(maxsize=1024)
+def _digest(path: str, size: int, mtime_ns: int, chunk_bytes: int, use_mmap: bool) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if use_mmap and size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for start in range(0, len(view), chunk_bytes):
+                    digest.update(view[start:start + chunk_bytes])
+        else:
+            for chunk in iter(lambda: f.read(chunk_bytes), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: str, chunk_bytes: int = CHUNK_BYTES, use_mmap: bool = False) -> str:
+    """
+    SHA-256 of a file's contents, streamed in chunks or read through mmap.
+
+    Digests are remembered per path, size and modification time, so tasks
+    that read the same file in one process hash it only once.
+    """
+    stat = os.stat(path)
+    return _digest(os.path.realpath(path), stat.st_size, stat.st_mtime_ns, chunk_bytes, use_mmap)
+
+
+@dataclass
+class FileContents(CachePolicy):
+    """
+    Keys a task on the contents of the files its path inputs point to.
+
+    Unlike INPUTS, which only sees the path, the key changes when the file
+    changes and stays the same when identical data is written under another
+    name. Inputs that are not listed are ignored; add INPUTS minus the path
+    inputs to key on them too. If a file can't be read no key is computed
+    and the task runs uncached.
+    """
+
+    path_inputs: Tuple[str, ...] = ()
+    chunk_bytes: int = CHUNK_BYTES
+    use_mmap: bool = False
+
+    def compute_key(
+        self,
+        task_ctx: TaskRunContext,
+        inputs: Dict[str, Any],
+        flow_parameters: Dict[str, Any],
+        **kwargs: Any,
+    ) -> Optional[str]:
+        try:
+            digests = [
+                (name, file_digest(inputs[name], self.chunk_bytes, self.use_mmap))
+                for name in self.path_inputs
+            ]
+        except OSError:
+            return None
+        return hash_objects("file-contents", digests)
@@ -0,0 +1,159 @@
+# key_storage.py
+
+import inspect
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from prefect.filesystems import WritableFileSystem
+from prefect.utilities.asyncutils import sync_compatible
+
+KEY_CACHE_DIR = os.environ.get("MLB_KEY_CACHE_DIR", "./.key_cache")
+MEMORY_MAX_BYTES = 16 * 1024 * 1024
+
+TIERS = ("memory", "disk", "remote")
+
+
+class _TierState:
+    """In-memory LRU of key records and hit counters, shared by every copy of a store."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counts = {tier: {"hits": 0, "misses": 0} for tier in TIERS}
+        self.writes = 0
+
+    def get(self, path: str) -> Optional[bytes]:
+        with self.lock:
+            content = self.entries.get(path)
+            if content is not None:
+                self.entries.move_to_end(path)
+            return content
+
+    def put(self, path: str, content: bytes) -> None:
+        # Records larger than the whole tier are only kept on disk and remotely
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[path] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def record(self, tier: str, hit: bool) -> None:
+        with self.lock:
+            self.counts[tier]["hits" if hit else "misses"] += 1
+
+
+_states: Dict[str, _TierState] = {}
+_states_lock = threading.Lock()
+
+
+class TieredKeyStorage(WritableFileSystem):
+    """
+    Key storage for cache policies that checks memory, then local disk, then
+    a remote file system such as an S3Bucket.
+
+    Writes go through to every tier. A record found in a lower tier is copied
+    into the tiers above it, so repeated cache checks on the same worker,
+    within a flow run or across runs, are answered without a network round
+    trip. The memory tier is bounded by memory_max_bytes and evicts the least
+    recently used records. Without a remote the store is memory and disk only.
+    """
+
+    _block_type_name = "Tiered Key Storage"
+
+    local_path: str = KEY_CACHE_DIR
+    memory_max_bytes: int = MEMORY_MAX_BYTES
+    remote: Optional[WritableFileSystem] = None
+
+    @property
+    def _state(self) -> _TierState:
+        # Keyed on the disk location so copies of the block share one memory tier
+        name = os.path.abspath(self.local_path)
+        with _states_lock:
+            if name not in _states:
+                _states[name] = _TierState(self.memory_max_bytes)
+            return _states[name]
+
+    def _disk_path(self, path: str) -> str:
+        return os.path.join(self.local_path, path)
+
+    def _read_disk(self, path: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, path: str, content: bytes) -> None:
+        disk_path = self._disk_path(path)
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        temp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, disk_path)
+
+    async def _call_remote(self, method: str, *args):
+        # S3Bucket methods are sync or async depending on the prefect-aws version
+        result = getattr(self.remote, method)(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    @sync_compatible
+    async def read_path(self, path: str) -> bytes:
+        state = self._state
+
+        content = state.get(path)
+        state.record("memory", content is not None)
+        if content is not None:
+            return content
+
+        content = self._read_disk(path)
+        state.record("disk", content is not None)
+        if content is not None:
+            state.put(path, content)
+            return content
+
+        if self.remote is None:
+            raise ValueError(f"Key {path} does not exist.")
+        try:
+            content = await self._call_remote("read_path", path)
+        except Exception:
+            state.record("remote", False)
+            raise
+        state.record("remote", True)
+
+        self._write_disk(path, content)
+        state.put(path, content)
+        return content
+
+    @sync_compatible
+    async def write_path(self, path: str, content: bytes) -> str:
+        state = self._state
+        if self.remote is not None:
+            await self._call_remote("write_path", path, content)
+        self._write_disk(path, content)
+        state.put(path, content)
+        with state.lock:
+            state.writes += 1
+        return path
+
+    def metrics(self) -> Dict:
+        """Hits and misses per tier, writes, and the size of the memory tier."""
+        state = self._state
+        with state.lock:
+            return {
+                "tiers": {tier: dict(counts) for tier, counts in state.counts.items()},
+                "writes": state.writes,
+                "memory_entries": len(state.entries),
+                "memory_bytes": state.size,
+            }
@@ -4,24 +4,38 @@ from datetime import datetime, timedelta
 from prefect_aws import S3Bucket
 import statsapi
 import json
+import os
 import pandas as pd
-from prefect.cache_policies import INPUTS, TASK_SOURCE, FLOW_PARAMETERS, NONE
+from prefect.cache_policies import INPUTS, TASK_SOURCE
+from cache_policies import FINAL_GAME_BOXSCORE, FileContents, file_digest
+from key_storage import TieredKeyStorage
+from cache_metrics import CACHE_METRICS, record_cache_result
 
+CLEAN_DATA_DIR = "./clean_data"
 
-@task(cache_policy=INPUTS, cache_expiration=timedelta(days=1))
+# Cache keys are checked in memory and on local disk before going to S3
+RAW_DATA_KEY_STORAGE = TieredKeyStorage(remote=S3Bucket(bucket_name="mlb-raw-data"))
+
+
+@task(
+    cache_policy=INPUTS,
+    cache_expiration=timedelta(days=1),
+    on_completion=[record_cache_result],
+)
 def get_recent_games(team_name, start_date, end_date):
-    """This task will fetch the schedule for the provided team and date range and return the game ids."""
+    """This task will fetch the schedule for the provided team and date range and return the game ids and statuses."""
     team = statsapi.lookup_team(team_name)
     schedule = statsapi.schedule(
         team=team[0]["id"], start_date=start_date, end_date=end_date
     )
     for game in schedule:
-        print(game["game_id"])
-    return [game["game_id"] for game in schedule]
+        print(game["game_id"], game["status"])
+    return [{"game_id": game["game_id"], "game_status": game["status"]} for game in schedule]
 
 
-@task(cache_policy=INPUTS + FLOW_PARAMETERS, cache_expiration=timedelta(hours=3))
-def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
+# Keyed on the game alone and never expires once the game is final
+@task(cache_policy=FINAL_GAME_BOXSCORE, on_completion=[record_cache_result])
+def fetch_single_game_boxscore(game_id, game_status):
     """This task will fetch the boxscore for a single game and return the game data."""
     boxscore = statsapi.boxscore_data(game_id)
 
@@ -36,9 +50,6 @@ def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
 
     # Create a dictionary with the game data
     game_data = {
-        "search_start_date": start_date,
-        "search_end_date": end_date,
-        "chosen_team_name": team_name,
         "game_id": game_id,
         "home_team": home_team,
         "away_team": away_team,
@@ -52,10 +63,19 @@ def fetch_single_game_boxscore(game_id, start_date, end_date, team_name):
     return game_data
 
 
+def add_search_window(game_data, start_date, end_date, team_name):
+    """Attach the search parameters of this run to a (possibly cached) boxscore."""
+    return {
+        "search_start_date": start_date,
+        "search_end_date": end_date,
+        "chosen_team_name": team_name,
+        **game_data,
+    }
+
+
 @task(
-    cache_policy=(INPUTS - "game_data").configure(
-        key_storage=S3Bucket(bucket_name="mlb-raw-data")
-    )
+    cache_policy=(INPUTS - "game_data").configure(key_storage=RAW_DATA_KEY_STORAGE),
+    on_completion=[record_cache_result],
 )
 def save_raw_data_to_file(game_data, file_name):
     """This task will save the raw data to a file."""
@@ -67,9 +87,12 @@ def save_raw_data_to_file(game_data, file_name):
     return file_name
 
 
-@task(cache_policy=NONE)
+@task(
+    cache_policy=TASK_SOURCE + FileContents(path_inputs=("data_file_path",)),
+    on_completion=[record_cache_result],
+)
 def clean_time_value(data_file_path):
-    """This task will clean the time value."""
+    """This task will clean the time value and save the cleaned data to a new file."""
 
     try:
         with open(data_file_path, "r") as f:
@@ -93,14 +116,21 @@ def clean_time_value(data_file_path):
         hours, minutes = map(int, game_data["game_time"].split(":"))
         game_data["game_time_in_minutes"] = hours * 60 + minutes
 
-    # Save the modified data back to the file
-    with open(data_file_path, "w") as f:
+    # Name the cleaned file after the raw contents, so a cached result
+    # from a run with the same games points at the same cleaned data
+    os.makedirs(CLEAN_DATA_DIR, exist_ok=True)
+    clean_file_path = os.path.join(CLEAN_DATA_DIR, f"{file_digest(data_file_path)}.json")
+    with open(clean_file_path, "w") as f:
         json.dump(game_data_list, f, indent=4, sort_keys=True)
 
-    return data_file_path
+    return clean_file_path
 
 
-@task(cache_policy=TASK_SOURCE + INPUTS, cache_expiration=timedelta(days=7))
+@task(
+    cache_policy=TASK_SOURCE + FileContents(path_inputs=("data_file_path",)),
+    cache_expiration=timedelta(days=7),
+    on_completion=[record_cache_result],
+)
 def analyze_games(data_file_path):
     """This task will analyze the game data and return the analysis."""
 
@@ -153,7 +183,7 @@ def analyze_games(data_file_path):
     return game_analysis
 
 
-@task(cache_policy=INPUTS - "file_name")
+@task(cache_policy=INPUTS - "file_name", on_completion=[record_cache_result])
 def save_analysis_to_file(game_analysis, file_name):
     """This task will save the analysis to a file."""
 
@@ -165,7 +195,10 @@ def save_analysis_to_file(game_analysis, file_name):
     return file_name
 
 
-@task(cache_policy=INPUTS)
+@task(
+    cache_policy=(INPUTS - "game_data_path") + FileContents(path_inputs=("game_data_path",)),
+    on_completion=[record_cache_result],
+)
 def game_analysis_artifact(game_analysis, game_data_path):
     """This task will create an artifact with the game analysis."""
 
@@ -208,12 +241,17 @@ Correlation between game time and score differential: {game_analysis['time_diffe
 @flow
 def mlb_flow(team_name, start_date, end_date):
     # Get recent games
-    game_ids = get_recent_games(team_name, start_date, end_date)
+    games = get_recent_games(team_name, start_date, end_date)
 
-    # Fetch boxscore for each game
+    # Fetch boxscore for each game, then add this run's search window, which is not part of the cache key
     game_data = [
-        fetch_single_game_boxscore(game_id, start_date, end_date, team_name)
-        for game_id in game_ids
+        add_search_window(
+            fetch_single_game_boxscore(game["game_id"], game["game_status"]),
+            start_date,
+            end_date,
+            team_name,
+        )
+        for game in games
     ]
 
     # Define file path for raw data
@@ -239,6 +277,10 @@ def mlb_flow(team_name, start_date, end_date):
     # Save the results to an artifact
     game_analysis_artifact(results, clean_data)
 
+    # Report how well each task's cache paid off in this run
+    print(f"Raw data key storage: {RAW_DATA_KEY_STORAGE.metrics()}")
+    CACHE_METRICS.publish(runtime.flow_run.id, flow_run_name)
+
 
 if __name__ == "__main__":
     mlb_flow("marlins", "06/01/2024", "06/30/2024")
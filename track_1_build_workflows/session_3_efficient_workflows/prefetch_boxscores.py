@@ -0,0 +1,61 @@
+from prefect import flow, task, runtime
+from datetime import datetime, timedelta
+import statsapi
+from cache_policies import is_final
+from main import fetch_single_game_boxscore
+from cache_metrics import CACHE_METRICS
+
+PREFETCH_TEAMS = ["marlins"]
+# Look back far enough to pick up games that went final since the last scheduled run
+PREFETCH_DAYS_BACK = 1
+PREFETCH_DAYS_AHEAD = 7
+
+
+@task
+def get_schedule(team_name, start_date, end_date):
+    """This task will fetch the schedule for the provided team and date range without caching, so game statuses are current."""
+    team = statsapi.lookup_team(team_name)
+    schedule = statsapi.schedule(
+        team=team[0]["id"], start_date=start_date, end_date=end_date
+    )
+    return [{"game_id": game["game_id"], "game_status": game["status"]} for game in schedule]
+
+
+@flow
+def prefetch_boxscores(team_names=PREFETCH_TEAMS, days_back=PREFETCH_DAYS_BACK, days_ahead=PREFETCH_DAYS_AHEAD):
+    # Date window around today, in the format mlb_flow takes
+    today = datetime.now()
+    start_date = (today - timedelta(days=days_back)).strftime("%m/%d/%Y")
+    end_date = (today + timedelta(days=days_ahead)).strftime("%m/%d/%Y")
+
+    # Collect the games of every team once, a game between two teams is fetched once
+    games = {}
+    for team_name in team_names:
+        for game in get_schedule(team_name, start_date, end_date):
+            games[game["game_id"]] = game["game_status"]
+
+    # Only final games are cached; the rest are picked up by a later run once they finish
+    final_games = [game_id for game_id, game_status in games.items() if is_final(game_status)]
+    print(f"{len(final_games)} of {len(games)} games between {start_date} and {end_date} are final")
+
+    # Same task and cache key as mlb_flow, so cached games return immediately
+    futures = [
+        fetch_single_game_boxscore.submit(game_id, games[game_id])
+        for game_id in final_games
+    ]
+    for future in futures:
+        future.result()
+
+    CACHE_METRICS.publish(runtime.flow_run.id, runtime.flow_run.name)
+
+    return final_games
+
+
+if __name__ == "__main__":
+    prefetch_boxscores()
+
+    # prefetch_boxscores.serve(
+    #     name="prefetch-boxscores",
+    #     parameters={"team_names": ["marlins"]},
+    #     cron="0 * * * *"
+    # )
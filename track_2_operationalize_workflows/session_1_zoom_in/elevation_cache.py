@@ -0,0 +1,199 @@
+# elevation_cache.py
+
+import contextlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+ELEVATION_CACHE_PATH = os.environ.get("ELEVATION_CACHE_PATH", "./elevation_cache.sqlite")
+
+# 4 decimal places is about 11 m, far smaller than a ballpark
+COORDINATE_DECIMALS = 4
+# A cached point this close counts as the same place; 0 only matches the same rounded coordinate
+NEAREST_TOLERANCE_METERS = float(os.environ.get("ELEVATION_CACHE_TOLERANCE_METERS", "0"))
+
+METERS_PER_DEGREE = 111_320
+EARTH_RADIUS_METERS = 6_371_000
+
+Coordinate = Tuple[float, float]
+
+
+def distance_meters(a: Coordinate, b: Coordinate) -> float:
+    """Haversine distance between two (latitude, longitude) points."""
+    lat_a, lon_a, lat_b, lon_b = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat_b - lat_a) / 2) ** 2
+        + math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+class ElevationCache:
+    """
+    Persistent SQLite cache of elevations, keyed on rounded coordinates.
+
+    Coordinates are rounded to `decimals` places and stored as integers, so
+    the same venue reported with slightly different floats shares one entry.
+    With a tolerance, a miss on the rounded key falls back to the nearest
+    cached point within that many metres. Elevations never expire. The
+    SQLite file is only created on first use.
+
+    The cache also remembers which (city, coordinate) rows this worker loaded
+    into ELEVATION_DATA. That is only a pre-filter that saves a round trip;
+    the rows are merged on their key, so a fresh worker or a deleted cache
+    file never duplicates them.
+    """
+
+    def __init__(
+        self,
+        path: str = ELEVATION_CACHE_PATH,
+        decimals: int = COORDINATE_DECIMALS,
+        tolerance_meters: float = NEAREST_TOLERANCE_METERS,
+    ):
+        self.path = path
+        self.decimals = decimals
+        self.tolerance_meters = tolerance_meters
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS elevations (
+                    lat_key INTEGER NOT NULL,
+                    lon_key INTEGER NOT NULL,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    elevation REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (lat_key, lon_key)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stored_rows (
+                    city TEXT NOT NULL,
+                    lat_key INTEGER NOT NULL,
+                    lon_key INTEGER NOT NULL,
+                    PRIMARY KEY (city, lat_key, lon_key)
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits when the block succeeds and is always closed."""
+        # A connection per call keeps the cache safe to use from task threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with self._lock:
+                if not self._initialized:
+                    self._initialize(conn)
+                    self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def key(self, coordinate: Coordinate) -> Tuple[int, int]:
+        scale = 10 ** self.decimals
+        return round(coordinate[0] * scale), round(coordinate[1] * scale)
+
+    def _nearest(self, conn: sqlite3.Connection, coordinate: Coordinate) -> Optional[float]:
+        """Elevation of the closest cached point within the tolerance, if any."""
+        lat, lon = coordinate
+        lat_delta = self.tolerance_meters / METERS_PER_DEGREE
+        lon_delta = lat_delta / max(math.cos(math.radians(lat)), 1e-6)
+        (lat_min, lon_min), (lat_max, lon_max) = (
+            self.key((lat - lat_delta, lon - lon_delta)),
+            self.key((lat + lat_delta, lon + lon_delta)),
+        )
+        candidates = conn.execute(
+            """
+            SELECT lat, lon, elevation FROM elevations
+            WHERE lat_key BETWEEN ? AND ? AND lon_key BETWEEN ? AND ?
+            """,
+            (lat_min, lat_max, lon_min, lon_max),
+        ).fetchall()
+
+        best = None
+        for cached_lat, cached_lon, elevation in candidates:
+            distance = distance_meters(coordinate, (cached_lat, cached_lon))
+            if distance <= self.tolerance_meters and (best is None or distance < best[0]):
+                best = (distance, elevation)
+        return best[1] if best else None
+
+    def lookup_many(self, coordinates: Iterable[Coordinate]) -> Dict[Coordinate, float]:
+        """Cached elevations of the coordinates that have one; missing ones are left out."""
+        found = {}
+        with self._connect() as conn:
+            for coordinate in dict.fromkeys(coordinates):
+                row = conn.execute(
+                    "SELECT elevation FROM elevations WHERE lat_key = ? AND lon_key = ?",
+                    self.key(coordinate),
+                ).fetchone()
+                elevation = row[0] if row else None
+                if elevation is None and self.tolerance_meters > 0:
+                    elevation = self._nearest(conn, coordinate)
+                if elevation is not None:
+                    found[coordinate] = elevation
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(dict.fromkeys(coordinates)) - len(found)
+        return found
+
+    def store_many(self, elevations: Dict[Coordinate, float]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO elevations VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (*self.key(coordinate), coordinate[0], coordinate[1], elevation, now)
+                    for coordinate, elevation in elevations.items()
+                ],
+            )
+
+    def new_rows(self, rows: List[Dict]) -> List[Dict]:
+        """The elevation rows (city, lat, lon, elevation) that were not loaded before."""
+        with self._connect() as conn:
+            stored = set(conn.execute("SELECT city, lat_key, lon_key FROM stored_rows").fetchall())
+
+        new, seen = [], set()
+        for row in rows:
+            row_key = (row["city"], *self.key((row["lat"], row["lon"])))
+            if row_key not in stored and row_key not in seen:
+                seen.add(row_key)
+                new.append(row)
+        return new
+
+    def mark_stored(self, rows: List[Dict]) -> None:
+        """Remember rows once they are in ELEVATION_DATA."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO stored_rows VALUES (?, ?, ?)",
+                [(row["city"], *self.key((row["lat"], row["lon"]))) for row in rows],
+            )
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus the number of cached points."""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM elevations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+elevation_cache = ElevationCache()
@@ -1,12 +1,17 @@
 from prefect import flow, task
 import httpx
-import requests
+import os
+from typing import Dict, List, Tuple
 from prefect_snowflake import SnowflakeCredentials
 
 # https://api.open-meteo.com/v1/elevation?latitude=52.52&longitude=13.41
 
 from prefect_snowflake.database import SnowflakeConnector
 from prefect._experimental.lineage import emit_lineage_event
+from lineage_buffer import lineage_buffer
+from elevation_cache import elevation_cache
+from snowflake_loader import get_loader
+import pyarrow as pa
 import asyncio
 from resources import (
     OPEN_METEO_ELEVATION_API,
@@ -14,6 +19,24 @@ from resources import (
     SNOWFLAKE_ELEVATION_DATA,
 )
 
+ELEVATION_DATA_COLUMNS = [
+    ("city", pa.string()),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("elevation", pa.float64()),
+]
+
+# A venue's row in ELEVATION_DATA is identified by its city and coordinates
+ELEVATION_DATA_KEY = ["city", "lat", "lon"]
+
+# Point at a local stand-in, e.g. http://localhost:8080/v1/elevation, in tests
+OPEN_METEO_ELEVATION_URL = os.environ.get(
+    "OPEN_METEO_ELEVATION_URL", "https://api.open-meteo.com/v1/elevation"
+)
+# The elevation API takes up to 100 coordinates per request
+ELEVATION_BATCH_SIZE = 100
+MAX_CONCURRENT_ELEVATION_REQUESTS = 4
+
 
 @task
 async def fetch_unique_city_locations():
@@ -35,48 +58,85 @@ async def fetch_unique_city_locations():
     return locations
 
 
-@task
-async def fetch_elevation_for_coordinates(latitude: float, longitude: float) -> float:
-    # for _, lat, long in locations:
-    #  get_elevation(lat, long)
+def batch_coordinates(
+    coordinates: List[Tuple[float, float]], batch_size: int = ELEVATION_BATCH_SIZE
+) -> List[List[Tuple[float, float]]]:
+    """Split coordinates into batches of at most batch_size, dropping duplicates."""
+    unique_coordinates = list(dict.fromkeys(coordinates))
+    return [
+        unique_coordinates[start : start + batch_size]
+        for start in range(0, len(unique_coordinates), batch_size)
+    ]
 
-    response = requests.get(
-        f"https://api.open-meteo.com/v1/elevation?latitude={latitude}&longitude={longitude}"
-    )
 
-    await emit_lineage_event(
-        event_name=f"Fetch Elevation Data for Coordinates; Latitude: {latitude}, Longitude: {longitude}",
-        upstream_resources=[OPEN_METEO_ELEVATION_API],
-        downstream_resources=None,
-        direction_of_run_from_event="downstream",
-    )
+@task
+async def fetch_elevations(
+    coordinates: List[Tuple[float, float]],
+    batch_size: int = ELEVATION_BATCH_SIZE,
+    max_concurrency: int = MAX_CONCURRENT_ELEVATION_REQUESTS,
+    base_url: str = OPEN_METEO_ELEVATION_URL,
+) -> List[float]:
+    """
+    Fetch the elevation of every (latitude, longitude) pair, in the same order.
+
+    Coordinates are sent as comma-separated lists, batch_size per request,
+    and the batches are fetched concurrently. Each coordinate is only
+    requested once, however often it appears.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    elevations = {}
+
+    async def fetch_batch(client: httpx.AsyncClient, batch: List[Tuple[float, float]]):
+        async with semaphore:
+            response = await client.get(
+                base_url,
+                params={
+                    "latitude": ",".join(str(lat) for lat, _ in batch),
+                    "longitude": ",".join(str(lon) for _, lon in batch),
+                },
+            )
+        response.raise_for_status()
+        batch_elevations = response.json()["elevation"]
+        if len(batch_elevations) != len(batch):
+            raise ValueError(
+                f"Expected {len(batch)} elevations, got {len(batch_elevations)}"
+            )
+        elevations.update(zip(batch, batch_elevations))
+
+        for latitude, longitude in batch:
+            lineage_buffer.record(
+                event_name="Fetch Elevation Data for Coordinates",
+                item_id=f"{latitude},{longitude}",
+                upstream_resources=[OPEN_METEO_ELEVATION_API],
+                downstream_resources=None,
+                direction_of_run_from_event="downstream",
+            )
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(
+            *(fetch_batch(client, batch) for batch in batch_coordinates(coordinates, batch_size))
+        )
 
-    return response.json()["elevation"]
+    return [elevations[coordinate] for coordinate in coordinates]
 
 
 @task
-async def create_and_insert_elevation_data(
-    block_name: str, locations: list, elevation: list
-) -> None:
+async def create_and_insert_elevation_data(block_name: str, rows: List[Dict]) -> None:
     snowflake_connector = await SnowflakeConnector.load(block_name)
     snowflake_connector.execute(
         f"CREATE TABLE IF NOT EXISTS {snowflake_connector.database}.PUBLIC.ELEVATION_DATA (city varchar, lat float, lon float, elevation float);"
     )
-    snowflake_connector.execute_many(
-        "INSERT INTO elevation_data (city, lat, lon, elevation) VALUES (%(city)s, %(lat)s, %(lon)s, %(elevation)s);",
-        seq_of_parameters=[
-            {
-                "city": location[0],
-                "lat": location[1],
-                "lon": location[2],
-                "elevation": elev,
-            }
-            for location, elev in zip(locations, elevation)
-        ],
+    # Merge rather than append, so rows the local cache didn't know were loaded aren't duplicated
+    get_loader().merge(
+        snowflake_connector,
+        f"{snowflake_connector.database}.PUBLIC.ELEVATION_DATA",
+        ELEVATION_DATA_COLUMNS,
+        rows,
+        key=ELEVATION_DATA_KEY,
     )
 
     await emit_lineage_event(
-        event_name=f"Upload Elevation Data to Snowflake; N Rows: {len(locations)}",
+        event_name=f"Upload Elevation Data to Snowflake; N Rows: {len(rows)}",
         upstream_resources=None,
         downstream_resources=[SNOWFLAKE_ELEVATION_DATA],
         direction_of_run_from_event="upstream",
@@ -85,16 +145,44 @@ async def create_and_insert_elevation_data(
 
 @flow
 async def process_and_store_elevation_data(snowflake_block_name: str):
-    locations = await fetch_unique_city_locations()
-
-    elevations = []
-    for _, lat, long in locations:
-        elevation = await fetch_elevation_for_coordinates(lat, long)
-
-        print(elevation)
-        elevations.append(elevation)
+    # Buffer lineage events and emit summarized ones in the background
+    async with lineage_buffer:
+        locations = await fetch_unique_city_locations()
+
+        # Venues without coordinates can't be looked up
+        locations = [
+            location for location in locations
+            if location[1] is not None and location[2] is not None
+        ]
+        coordinates = [(lat, long) for _, lat, long in locations]
+
+        # Only coordinates the cache has not seen reach the elevation API,
+        # one request per batch of coordinates instead of one per venue
+        elevations = elevation_cache.lookup_many(coordinates)
+        missing = [
+            coordinate for coordinate in dict.fromkeys(coordinates)
+            if coordinate not in elevations
+        ]
+        if missing:
+            fetched = dict(zip(missing, await fetch_elevations(missing)))
+            elevation_cache.store_many(fetched)
+            elevations.update(fetched)
+        print(f"Elevation cache: {elevation_cache.stats()}")
+
+        # The local cache skips rows this worker already loaded; the merge
+        # keeps ELEVATION_DATA key-unique when the cache is new or was lost
+        rows = elevation_cache.new_rows(
+            [
+                {"city": city, "lat": lat, "lon": long, "elevation": elevations[(lat, long)]}
+                for city, lat, long in locations
+            ]
+        )
+        if not rows:
+            print("No new elevation rows to insert.")
+            return
 
-    await create_and_insert_elevation_data(snowflake_block_name, locations, elevations)
+        await create_and_insert_elevation_data(snowflake_block_name, rows)
+        elevation_cache.mark_stored(rows)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,13 @@
 # get_mlb_data.py
 
 from prefect import flow, task
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import statsapi
 import json
 import pandas as pd
 import os
 from prefect.tasks import exponential_backoff
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import asyncio
 from prefect.futures import wait
 
@@ -16,11 +16,14 @@ from snowflake_helper import (
     create_mlb_snowflake_tables,
     insert_game_scores_into_snowflake,
     insert_game_locations_into_snowflake,
+    fetch_ingested_games,
+    record_ingested_games,
 )
+from mlb_api_cache import mlb_api_cache, is_final_status
 from prefect._experimental.lineage import emit_lineage_event
+from lineage_buffer import lineage_buffer
 from resources import (
     MLB_API_SCHEDULE,
-    MLB_API_SCORE,
     MLB_API_LOCATION,
     HIGHLIGHTED_TEAMS_S3_FILE,
 )
@@ -28,6 +31,11 @@ from prefect_aws.s3 import S3Bucket
 import pandas as pd
 import time
 
+SCHEDULE_CHUNK_DAYS = 90
+MAX_CONCURRENT_SCHEDULE_REQUESTS = 8
+MAX_CONCURRENT_FEED_REQUESTS = 16
+SNOWFLAKE_BATCH_SIZE = 250
+
 
 @task
 async def get_highlighted_teams_data_from_s3() -> pd.DataFrame:
@@ -58,116 +66,147 @@ async def get_highlighted_teams_data_from_s3() -> pd.DataFrame:
     return team_ids
 
 
+def split_date_range(
+    start_date: str, end_date: str, chunk_days: int = SCHEDULE_CHUNK_DAYS
+) -> List[Tuple[str, str]]:
+    """
+    Split an inclusive YYYY-MM-DD date range into consecutive windows of at most chunk_days.
+    """
+    window_start = date.fromisoformat(start_date)
+    last_day = date.fromisoformat(end_date)
+    windows = []
+    while window_start <= last_day:
+        window_end = min(window_start + timedelta(days=chunk_days - 1), last_day)
+        windows.append((window_start.isoformat(), window_end.isoformat()))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
 @task
-async def retrieve_recent_game_ids(
-    team_ids: List[int], start_date: str, end_date: str
-) -> List[str]:
+async def retrieve_recent_games(
+    team_ids: List[int],
+    start_date: str,
+    end_date: str,
+    chunk_days: int = SCHEDULE_CHUNK_DAYS,
+    max_concurrency: int = MAX_CONCURRENT_SCHEDULE_REQUESTS,
+) -> Dict[str, Dict]:
     """
-    Retrieve recent game IDs for the specified teams and date range.
+    Retrieve schedule metadata for the specified teams and date range, keyed by game ID.
+
+    The date range is split into chunks and every team x chunk window is fetched
+    concurrently. Games between two of the teams appear in both schedules but are
+    only kept once.
     """
-    all_game_ids = []
-    for team_id in team_ids:
-        # Assuming statsapi.schedule is synchronous; wrap it in a thread
-        schedule = statsapi.schedule(
-            team=team_id, start_date=start_date, end_date=end_date
+    semaphore = asyncio.Semaphore(max_concurrency)
+    seen_game_ids = set()
+    games = []
+
+    async def fetch_schedule_window(team_id: int, window_start: str, window_end: str):
+        async with semaphore:
+            # statsapi is synchronous, so run it in a thread
+            schedule = await asyncio.to_thread(
+                mlb_api_cache.schedule,
+                team=team_id,
+                start_date=window_start,
+                end_date=window_end,
+            )
+        for game in schedule:
+            # Ensure game_id is present, all digits, and not seen for another team
+            game_id = str(game.get("game_id", ""))
+            if not game_id.isdigit() or game_id in seen_game_ids:
+                continue
+            seen_game_ids.add(game_id)
+            games.append(
+                {
+                    "game_id": game_id,
+                    "game_date": game.get("game_date", ""),
+                    "status": game.get("status", "Unknown"),
+                    "venue_id": game.get("venue_id", 0),
+                    "venue_name": game.get("venue_name", "Unknown"),
+                }
+            )
+
+    windows = split_date_range(start_date, end_date, chunk_days)
+    await asyncio.gather(
+        *(
+            fetch_schedule_window(team_id, window_start, window_end)
+            for team_id in team_ids
+            for window_start, window_end in windows
         )
-        await emit_lineage_event(
-            event_name=f"Get Recent Games; Team ID: {team_id} Date Range: {start_date} {end_date}",
+    )
+
+    for team_id in team_ids:
+        lineage_buffer.record(
+            event_name=f"Get Recent Games; Date Range: {start_date} {end_date}",
+            item_id=team_id,
             upstream_resources=[MLB_API_SCHEDULE],
             downstream_resources=None,
             direction_of_run_from_event="downstream",
         )
-        # Ensure game_id is string and present
-        game_ids = [str(game["game_id"]) for game in schedule if "game_id" in game]
-        print(f"Retrieved {len(game_ids)} games for team ID {team_id}.")
-        all_game_ids.extend(game_ids)
-
-    # Remove duplicates and ensure all are digits
-    unique_game_ids = list({gid for gid in all_game_ids if gid.isdigit()})
-
-    return unique_game_ids
 
-
-@task(retries=5, retry_delay_seconds=exponential_backoff(backoff_factor=10))
-async def fetch_game_score_data(game_id: str) -> Dict:
-    boxscore = statsapi.boxscore_data(game_id)
-
-    await emit_lineage_event(
-        event_name=f"Fetch Game Score; Game ID: {game_id}",
-        upstream_resources=[MLB_API_SCORE],
-        downstream_resources=None,
-        direction_of_run_from_event="downstream",
+    print(
+        f"Retrieved {len(games)} unique games for {len(team_ids)} teams "
+        f"across {len(windows)} date windows."
     )
+    games.sort(key=lambda game: (game["game_date"], game["game_id"]))
+    return {game["game_id"]: game for game in games}
 
-    if not boxscore:
-        print(f"No boxscore data found for game ID {game_id}.")
-        return {}
 
-    # Extract relevant data with correct key names
+def extract_score_data(game_id: str, game: Dict) -> Dict:
+    """
+    Build a GAME_SCORES row from a game's live feed.
+    """
+    teams = game.get("gameData", {}).get("teams", {})
+    boxscore = game.get("liveData", {}).get("boxscore", {})
     home_score = (
-        boxscore.get("home", {}).get("teamStats", {}).get("batting", {}).get("runs", 0)
+        boxscore.get("teams", {})
+        .get("home", {})
+        .get("teamStats", {})
+        .get("batting", {})
+        .get("runs", 0)
     )
     away_score = (
-        boxscore.get("away", {}).get("teamStats", {}).get("batting", {}).get("runs", 0)
+        boxscore.get("teams", {})
+        .get("away", {})
+        .get("teamStats", {})
+        .get("batting", {})
+        .get("runs", 0)
     )
-    home_team = boxscore.get("teamInfo", {}).get("home", {}).get("teamName", "Unknown")
-    away_team = boxscore.get("teamInfo", {}).get("away", {}).get("teamName", "Unknown")
-    home_team_id = (
-        boxscore.get("teamInfo", {}).get("home", {}).get("id", 0)
-    )  # Default to 0 if missing
-    away_team_id = (
-        boxscore.get("teamInfo", {}).get("away", {}).get("id", 0)
-    )  # Default to 0 if missing
+    home_team_id = teams.get("home", {}).get("id", 0)
+    away_team_id = teams.get("away", {}).get("id", 0)
     time_value = next(
         (
             item.get("value", "Unknown")
-            for item in boxscore.get("gameBoxInfo", [])
+            for item in boxscore.get("info", [])
             if item.get("label") == "T"
         ),
         "Unknown",
     )
 
-    # Create a dictionary with the game score data
-    score_data = {
+    return {
         "game_id": int(game_id),  # Ensure GAME_ID is integer
         "home_team_id": int(home_team_id) if home_team_id else 0,
-        "home_team": home_team,
+        "home_team": teams.get("home", {}).get("teamName", "Unknown"),
         "away_team_id": int(away_team_id) if away_team_id else 0,
-        "away_team": away_team,
+        "away_team": teams.get("away", {}).get("teamName", "Unknown"),
         "home_score": int(home_score),
         "away_score": int(away_score),
         "score_differential": abs(int(home_score) - int(away_score)),
         "game_time": time_value,
     }
 
-    return score_data
-
 
-@task(retries=5, retry_delay_seconds=exponential_backoff(backoff_factor=10))
-async def fetch_game_location_data(game_id: str) -> Dict:
+def extract_location_data(game_id: str, game: Dict) -> Dict:
     """
-    Fetch game location details for each game.
+    Build a GAME_LOCATIONS row from a game's live feed.
     """
-    game = statsapi.get("game", params={"gamePk": game_id})
-
-    await emit_lineage_event(
-        event_name=f"Fetch Game Location; Game ID: {game_id}",
-        upstream_resources=[MLB_API_LOCATION],
-        downstream_resources=None,
-        direction_of_run_from_event="downstream",
-    )
-
-    if not game:
-        print(f"No location data found for game ID {game_id}.")
-        return {}
-
     # Access venue data correctly
     game_data = game.get("gameData", {})
     venue = game_data.get("venue", {})
     location = venue.get("location", {})
     default_coordinates = location.get("defaultCoordinates", {})
 
-    location_data = {
+    return {
         "game_id": int(game_id),  # Ensure GAME_ID is integer
         "venue_id": int(venue.get("id", 0)) if venue.get("id") else 0,
         "venue_name": venue.get("name", "Unknown"),
@@ -182,7 +221,104 @@ async def fetch_game_location_data(game_id: str) -> Dict:
         ),  # Handle elevation with default
     }
 
-    return location_data
+
+@task(retries=5, retry_delay_seconds=exponential_backoff(backoff_factor=10))
+async def fetch_game_feed_data(game_id: str) -> Dict:
+    """
+    Fetch the live feed for a game once and derive both its score and location rows.
+    """
+    # statsapi is synchronous; run it in a thread so concurrent fetches overlap
+    game = await asyncio.to_thread(mlb_api_cache.get, "game", params={"gamePk": game_id})
+
+    lineage_buffer.record(
+        event_name="Fetch Game Feed",
+        item_id=game_id,
+        upstream_resources=[MLB_API_LOCATION],
+        downstream_resources=None,
+        direction_of_run_from_event="downstream",
+    )
+
+    if not game:
+        print(f"No feed data found for game ID {game_id}.")
+        return {}
+
+    return {
+        "score": extract_score_data(game_id, game),
+        "location": extract_location_data(game_id, game),
+    }
+
+
+async def stream_games_into_snowflake(
+    games: List[Dict],
+    snowflake_block: str,
+    batch_size: int = SNOWFLAKE_BATCH_SIZE,
+    max_concurrency: int = MAX_CONCURRENT_FEED_REQUESTS,
+) -> int:
+    """
+    Fetch game feeds concurrently and flush their rows into Snowflake in fixed-size batches.
+
+    Fetched rows pass through a bounded queue, so fetchers wait whenever the
+    Snowflake writer falls behind. Every batch advances the ingestion watermark
+    right after it is inserted, so a failure only loses the batch in progress.
+    Returns the number of games loaded.
+    """
+    queue = asyncio.Queue(maxsize=batch_size)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_game(game: Dict):
+        # Hold the slot until the row is queued, so a full queue pauses fetching
+        async with semaphore:
+            try:
+                feed_data = await fetch_game_feed_data(game["game_id"])
+            except Exception as e:
+                # Left out of the watermark, so the next run picks it up again
+                print(f"Skipping game ID {game['game_id']}: {e}")
+                return
+            if feed_data:
+                await queue.put((game, feed_data))
+
+    async def flush_batch(batch: List[Tuple[Dict, Dict]]):
+        await insert_game_scores_into_snowflake(
+            game_scores=[feed_data["score"] for _, feed_data in batch],
+            block_name=snowflake_block,
+        )
+        await insert_game_locations_into_snowflake(
+            game_locations=[feed_data["location"] for _, feed_data in batch],
+            block_name=snowflake_block,
+        )
+        # Checkpoint the batch
+        await record_ingested_games(
+            games=[game for game, _ in batch], block_name=snowflake_block
+        )
+
+    async def write_batches() -> int:
+        loaded = 0
+        batch = []
+        while (item := await queue.get()) is not None:
+            batch.append(item)
+            if len(batch) == batch_size:
+                await flush_batch(batch)
+                loaded += len(batch)
+                batch = []
+        if batch:
+            await flush_batch(batch)
+            loaded += len(batch)
+        return loaded
+
+    writer = asyncio.create_task(write_batches())
+    fetchers = asyncio.gather(*(fetch_game(game) for game in games))
+    done, _ = await asyncio.wait(
+        {writer, fetchers}, return_when=asyncio.FIRST_COMPLETED
+    )
+    if writer in done:
+        # The writer only stops early when a Snowflake insert failed
+        fetchers.cancel()
+        # Let the fetchers finish cancelling before the writer's error is raised
+        await asyncio.gather(fetchers, return_exceptions=True)
+        return writer.result()
+
+    await queue.put(None)
+    return await writer
 
 
 @flow
@@ -193,51 +329,36 @@ async def fetch_and_store_mlb_raw_data(
     Prefect flow to fetch game scores and locations for multiple teams, then insert them into Snowflake.
     """
 
-    # Step 0: Get highlighted teams data to analyze
-    team_ids = await get_highlighted_teams_data_from_s3()
-
-    # Step 1: Set up Snowflake tables
-    await create_mlb_snowflake_tables(block_name=snowflake_block)
-
-    # Step 2: Get recent game IDs for all teams
-    game_ids = await retrieve_recent_game_ids(team_ids, start_date, end_date)
-
-    # Step 3: Fetch game scores
-    scores = []
-    tasks = []
-    for game_id in game_ids:
-        task_future = fetch_game_score_data.submit(game_id)
-        tasks.append(task_future)
-        print(f"Submitted score fetch for game ID {game_id}.")
-    # Gather all results asynchronously
-    for task in tasks:
-        scores.append(task.result())
-    # Filter out any empty dictionaries in case of missing data
-    scores = [score for score in scores if score]
-
-    # Step 4: Fetch game locations
-    locations = []
-    tasks = []
-    for game_id in game_ids:
-        task_future = fetch_game_location_data.submit(game_id)
-        tasks.append(task_future)
-        print(f"Submitted location fetch for game ID {game_id}.")
-    # Gather all results asynchronously
-    for task in tasks:
-        locations.append(task.result())
-
-    # Filter out any empty dictionaries in case of missing data
-    locations = [location for location in locations if location]
-
-    # Step 5: Insert data into Snowflake
-    await insert_game_scores_into_snowflake(
-        game_scores=scores, block_name=snowflake_block
-    )
-    await insert_game_locations_into_snowflake(
-        game_locations=locations, block_name=snowflake_block
-    )
+    # Buffer lineage events and emit summarized ones in the background
+    async with lineage_buffer:
+        # Step 0: Get highlighted teams data to analyze
+        team_ids = await get_highlighted_teams_data_from_s3()
 
-    print("MLB Simple Flow Completed Successfully.")
+        # Step 1: Set up Snowflake tables
+        await create_mlb_snowflake_tables(block_name=snowflake_block)
+
+        # Step 2: Get the schedule for all teams
+        games = await retrieve_recent_games(team_ids, start_date, end_date)
+
+        # Step 3: Get the ingestion watermark of the scheduled games and keep
+        # the final games that are new or changed since an earlier run
+        ingested_games = await fetch_ingested_games(
+            game_ids=list(games), block_name=snowflake_block
+        )
+        new_games = [
+            game
+            for game in games.values()
+            if is_final_status(game["status"])
+            and ingested_games.get(int(game["game_id"]), {}).get("status") != game["status"]
+        ]
+        print(f"{len(new_games)} of {len(games)} scheduled games are final and not yet ingested.")
+
+        # Step 4: Stream each game's score and location into Snowflake in batches
+        loaded = await stream_games_into_snowflake(new_games, snowflake_block)
+        print(f"Loaded {loaded} of {len(new_games)} new games into Snowflake.")
+
+        print(f"MLB API cache stats: {mlb_api_cache.stats()}")
+        print("MLB Simple Flow Completed Successfully.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+# lineage_buffer.py
+
+import asyncio
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from prefect._experimental.lineage import emit_lineage_event
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = 30
+
+
+def resource_ids(resources: Optional[List[Dict]]) -> Tuple[str, ...]:
+    return tuple(resource["prefect.resource.id"] for resource in resources or [])
+
+
+class LineageBuffer:
+    """
+    Collects lineage events in memory and emits one summarized event per
+    upstream/downstream resource pair every flush interval.
+
+    Recording is a cheap, thread-safe append, so tasks no longer wait on the
+    events API. Use the buffer as an async context manager inside a flow to
+    flush it in the background and once more on exit:
+
+        async with lineage_buffer:
+            ...
+
+    Each flow entering the buffer gets its own background flusher, so flows
+    running concurrently in one process can share it. Events whose flush
+    failed stay buffered for the next one.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+        # Flushers of the `async with` blocks the current context is in
+        self._flushers: ContextVar[Tuple[asyncio.Task, ...]] = ContextVar(
+            f"lineage_flushers_{id(self)}", default=()
+        )
+
+    def record(
+        self,
+        event_name: str,
+        item_id=None,
+        upstream_resources: Optional[List[Dict]] = None,
+        downstream_resources: Optional[List[Dict]] = None,
+        direction_of_run_from_event: str = "downstream",
+    ) -> None:
+        """Buffer one lineage event; a numeric item_id (e.g. a game ID) widens the summarized ID range."""
+        key = (
+            event_name,
+            resource_ids(upstream_resources),
+            resource_ids(downstream_resources),
+            direction_of_run_from_event,
+        )
+        with self._lock:
+            entry = self._pending.setdefault(
+                key,
+                {
+                    "upstream_resources": upstream_resources,
+                    "downstream_resources": downstream_resources,
+                    "count": 0,
+                    "min_id": None,
+                    "max_id": None,
+                    "numeric_ids": True,
+                },
+            )
+            entry["count"] += 1
+            if item_id is None:
+                return
+            if not str(item_id).isdigit():
+                # A range of e.g. "lat,lon" strings means nothing, so none is reported
+                entry["numeric_ids"] = False
+                return
+            item_id = int(item_id)
+            entry["min_id"] = item_id if entry["min_id"] is None else min(entry["min_id"], item_id)
+            entry["max_id"] = item_id if entry["max_id"] is None else max(entry["max_id"], item_id)
+
+    @staticmethod
+    def summarize(event_name: str, entry: Dict) -> str:
+        summary = f"{event_name}; N Events: {entry['count']}"
+        if entry["numeric_ids"] and entry["min_id"] is not None:
+            summary += f"; ID Range: {entry['min_id']} - {entry['max_id']}"
+        return summary
+
+    def _restore(self, entries: Dict[Tuple, Dict]) -> None:
+        """Put entries that were not emitted back, combined with events recorded since."""
+        with self._lock:
+            for key, entry in entries.items():
+                recorded = self._pending.get(key)
+                if recorded is not None:
+                    entry["count"] += recorded["count"]
+                    entry["numeric_ids"] = entry["numeric_ids"] and recorded["numeric_ids"]
+                    ids = [i for i in (entry["min_id"], entry["max_id"], recorded["min_id"], recorded["max_id"]) if i is not None]
+                    entry["min_id"], entry["max_id"] = (min(ids), max(ids)) if ids else (None, None)
+                self._pending[key] = entry
+
+    async def flush(self) -> int:
+        """Emit one summarized event per buffered resource pair. Returns the number emitted."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        remaining = dict(pending)
+        try:
+            for key, entry in pending.items():
+                event_name, _, _, direction = key
+                await emit_lineage_event(
+                    event_name=self.summarize(event_name, entry),
+                    upstream_resources=entry["upstream_resources"],
+                    downstream_resources=entry["downstream_resources"],
+                    direction_of_run_from_event=direction,
+                )
+                del remaining[key]
+        except BaseException:
+            # Keep what was not emitted, so the next flush retries it
+            self._restore(remaining)
+            raise
+
+        if pending:
+            logger.info(f"Flushed {len(pending)} summarized lineage events.")
+        return len(pending)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Lineage is best effort; keep the pipeline running
+                logger.error(f"Failed to flush lineage events: {e}")
+
+    async def __aenter__(self) -> "LineageBuffer":
+        flusher = asyncio.create_task(self._flush_periodically())
+        self._flushers.set(self._flushers.get() + (flusher,))
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        # Only stop the flusher this block started, not another flow's
+        *outer, flusher = self._flushers.get()
+        self._flushers.set(tuple(outer))
+        flusher.cancel()
+        try:
+            await flusher
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.flush()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            # Don't hide the error the flow failed with
+            logger.error(f"Failed to flush lineage events: {e}")
+
+
+lineage_buffer = LineageBuffer()
@@ -4,14 +4,52 @@ from prefect import task
 from prefect_snowflake import SnowflakeConnector
 import logging
 from typing import List, Dict
+from datetime import date
 import asyncio
 from prefect._experimental.lineage import emit_lineage_event
+import pyarrow as pa
 from resources import SNOWFLAKE_GAME_SCORES, SNOWFLAKE_GAME_LOCATIONS
+from snowflake_loader import get_loader
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Loaded columns of each table, with the Arrow type used for staged Parquet files
+GAME_SCORES_COLUMNS = [
+    ("game_id", pa.int64()),
+    ("home_team_id", pa.int64()),
+    ("home_team", pa.string()),
+    ("away_team_id", pa.int64()),
+    ("away_team", pa.string()),
+    ("home_score", pa.int64()),
+    ("away_score", pa.int64()),
+    ("score_differential", pa.int64()),
+    ("game_time", pa.string()),
+]
+
+GAME_LOCATIONS_COLUMNS = [
+    ("game_id", pa.int64()),
+    ("venue_id", pa.int64()),
+    ("venue_name", pa.string()),
+    ("venue_city", pa.string()),
+    ("venue_state", pa.string()),
+    ("venue_postal_code", pa.string()),
+    ("venue_country", pa.string()),
+    ("venue_latitude", pa.float64()),
+    ("venue_longitude", pa.float64()),
+    ("venue_elevation", pa.float64()),
+]
+
+INGESTED_GAMES_COLUMNS = [
+    ("game_id", pa.int64()),
+    ("game_date", pa.date32()),
+    ("status", pa.string()),
+]
+
+# Game IDs looked up per watermark query, keeping the IN lists short
+INGESTED_GAMES_LOOKUP_BATCH_SIZE = 1000
+
 
 @task
 async def create_mlb_snowflake_tables(block_name: str):
@@ -50,6 +88,15 @@ async def create_mlb_snowflake_tables(block_name: str):
             );
         """
 
+        ingested_games_table_sql = f"""
+            CREATE TABLE IF NOT EXISTS {snowflake_connector.database}.PUBLIC.INGESTED_GAMES (
+                GAME_ID INTEGER,
+                GAME_DATE DATE,
+                STATUS VARCHAR,
+                INGESTED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+            );
+        """
+
         # Execute the SQL statements asynchronously
         snowflake_connector.execute(game_scores_table_sql)
         logger.info("Created table: GAME_SCORES")
@@ -57,6 +104,9 @@ async def create_mlb_snowflake_tables(block_name: str):
         snowflake_connector.execute(game_locations_table_sql)
         logger.info("Created table: GAME_LOCATIONS")
 
+        snowflake_connector.execute(ingested_games_table_sql)
+        logger.info("Created table: INGESTED_GAMES")
+
     except Exception as e:
         logger.error(f"Error setting up tables: {e}")
         raise e
@@ -64,7 +114,7 @@ async def create_mlb_snowflake_tables(block_name: str):
 
 @task
 async def insert_game_scores_into_snowflake(game_scores: List[Dict], block_name: str):
-    """Insert game scores data into Snowflake."""
+    """Upsert game scores data into Snowflake, one row per game."""
     if not game_scores:
         logger.info("No game scores to insert.")
         return
@@ -73,34 +123,14 @@ async def insert_game_scores_into_snowflake(game_scores: List[Dict], block_name:
         # Load the Snowflake connector asynchronously
         snowflake_connector = await SnowflakeConnector.load(block_name)
 
-        # Define the SQL statement
-        insert_sql = f"""
-            INSERT INTO {snowflake_connector.database}.PUBLIC.GAME_SCORES (
-                GAME_ID,
-                HOME_TEAM_ID,
-                HOME_TEAM,
-                AWAY_TEAM_ID,
-                AWAY_TEAM,
-                HOME_SCORE,
-                AWAY_SCORE,
-                SCORE_DIFFERENTIAL,
-                GAME_TIME
-            )
-            VALUES (
-                %(game_id)s,
-                %(home_team_id)s,
-                %(home_team)s,
-                %(away_team_id)s,
-                %(away_team)s,
-                %(home_score)s,
-                %(away_score)s,
-                %(score_differential)s,
-                %(game_time)s
-            );
-        """
-
-        # Execute the insert asynchronously
-        snowflake_connector.execute_many(insert_sql, game_scores)
+        # Stage the rows with the configured loader and merge them on GAME_ID,
+        # so rerunning the flow for the same games never duplicates them
+        get_loader().merge(
+            snowflake_connector,
+            f"{snowflake_connector.database}.PUBLIC.GAME_SCORES",
+            GAME_SCORES_COLUMNS,
+            game_scores,
+        )
         await emit_lineage_event(
             event_name=f"Upload Game Scores to Snowflake; N Rows: {len(game_scores)}",
             upstream_resources=None,
@@ -108,7 +138,7 @@ async def insert_game_scores_into_snowflake(game_scores: List[Dict], block_name:
             direction_of_run_from_event="upstream",
         )
 
-        logger.info(f"Inserted {len(game_scores)} game scores into Snowflake.")
+        logger.info(f"Merged {len(game_scores)} game scores into Snowflake.")
 
     except Exception as e:
         logger.error(f"Failed to insert game scores: {e}")
@@ -119,7 +149,7 @@ async def insert_game_scores_into_snowflake(game_scores: List[Dict], block_name:
 async def insert_game_locations_into_snowflake(
     game_locations: List[Dict], block_name: str
 ):
-    """Insert game locations data into Snowflake."""
+    """Upsert game locations data into Snowflake, one row per game."""
     if not game_locations:
         logger.info("No game locations to insert.")
         return
@@ -128,44 +158,91 @@ async def insert_game_locations_into_snowflake(
         # Load the Snowflake connector asynchronously
         snowflake_connector = await SnowflakeConnector.load(block_name)
 
-        # Define the SQL statement
-        insert_sql = f"""
-            INSERT INTO {snowflake_connector.database}.PUBLIC.GAME_LOCATIONS (
-                GAME_ID,
-                VENUE_ID,
-                VENUE_NAME,
-                VENUE_CITY,
-                VENUE_STATE,
-                VENUE_POSTAL_CODE,
-                VENUE_COUNTRY,
-                VENUE_LATITUDE,
-                VENUE_LONGITUDE,
-                VENUE_ELEVATION
-            )
-            VALUES (
-                %(game_id)s,
-                %(venue_id)s,
-                %(venue_name)s,
-                %(venue_city)s,
-                %(venue_state)s,
-                %(venue_postal_code)s,
-                %(venue_country)s,
-                %(venue_latitude)s,
-                %(venue_longitude)s,
-                %(venue_elevation)s
-            );
-        """
-
-        # Execute the insert asynchronously
-        snowflake_connector.execute_many(insert_sql, game_locations)
+        # Stage the rows with the configured loader and merge them on GAME_ID,
+        # so rerunning the flow for the same games never duplicates them
+        get_loader().merge(
+            snowflake_connector,
+            f"{snowflake_connector.database}.PUBLIC.GAME_LOCATIONS",
+            GAME_LOCATIONS_COLUMNS,
+            game_locations,
+        )
         await emit_lineage_event(
             event_name=f"Upload Game Locations to Snowflake; N Rows: {len(game_locations)}",
             upstream_resources=None,
             downstream_resources=[SNOWFLAKE_GAME_LOCATIONS],
             direction_of_run_from_event="upstream",
         )
-        logger.info(f"Inserted {len(game_locations)} game locations into Snowflake.")
+        logger.info(f"Merged {len(game_locations)} game locations into Snowflake.")
 
     except Exception as e:
         logger.error(f"Failed to insert game locations: {e}")
         raise e
+
+
+@task
+async def fetch_ingested_games(game_ids: List[str], block_name: str) -> Dict[int, Dict]:
+    """Fetch the ingestion watermark of the given games: the ones already loaded, keyed by GAME_ID."""
+    game_ids = sorted({int(game_id) for game_id in game_ids})
+    if not game_ids:
+        return {}
+
+    try:
+        # Load the Snowflake connector asynchronously
+        snowflake_connector = await SnowflakeConnector.load(block_name)
+
+        # Only read the entries of the scheduled games, not the whole table
+        rows = []
+        for start in range(0, len(game_ids), INGESTED_GAMES_LOOKUP_BATCH_SIZE):
+            batch = game_ids[start : start + INGESTED_GAMES_LOOKUP_BATCH_SIZE]
+            rows.extend(
+                snowflake_connector.fetch_all(
+                    f"""
+                    SELECT GAME_ID, GAME_DATE, STATUS
+                    FROM {snowflake_connector.database}.PUBLIC.INGESTED_GAMES
+                    WHERE GAME_ID IN ({", ".join(str(game_id) for game_id in batch)});
+                    """
+                )
+            )
+        logger.info(f"Found {len(rows)} of {len(game_ids)} scheduled games already ingested.")
+
+        return {
+            int(game_id): {"game_date": game_date, "status": status}
+            for game_id, game_date, status in rows
+        }
+
+    except Exception as e:
+        logger.error(f"Failed to fetch ingested games: {e}")
+        raise e
+
+
+@task
+async def record_ingested_games(games: List[Dict], block_name: str):
+    """Advance the ingestion watermark once the games' rows have been inserted."""
+    if not games:
+        logger.info("No ingested games to record.")
+        return
+
+    try:
+        # Load the Snowflake connector asynchronously
+        snowflake_connector = await SnowflakeConnector.load(block_name)
+
+        # Merge on GAME_ID in one statement, so each game is recorded once and
+        # a failed load never drops the entries that were already there
+        get_loader().merge(
+            snowflake_connector,
+            f"{snowflake_connector.database}.PUBLIC.INGESTED_GAMES",
+            INGESTED_GAMES_COLUMNS,
+            [
+                {
+                    "game_id": int(game["game_id"]),
+                    "game_date": date.fromisoformat(game["game_date"]) if game["game_date"] else None,
+                    "status": game["status"],
+                }
+                for game in games
+            ],
+        )
+        logger.info(f"Recorded {len(games)} ingested games.")
+
+    except Exception as e:
+        logger.error(f"Failed to record ingested games: {e}")
+        raise e
@@ -17,6 +17,7 @@ from prefect_aws.s3 import S3Bucket
 
 # Importing Snowflake helper tasks
 from snowflake_helper import setup_tables, insert_game_scores, insert_game_locations
+from mlb_api_cache import mlb_api_cache
 from prefect._experimental.lineage import emit_lineage_event
 from resources import MLB_API_SCHEDULE
 
@@ -33,7 +34,7 @@ async def get_recent_games(
     all_game_ids = []
     for team_id in team_ids:
         # Assuming statsapi.schedule is synchronous; wrap it in a thread
-        schedule = statsapi.schedule(
+        schedule = mlb_api_cache.schedule(
             team=team_id, start_date=start_date, end_date=end_date
         )
         await emit_lineage_event(
@@ -54,7 +55,7 @@ async def get_recent_games(
 
 @task(retries=5, retry_delay_seconds=exponential_backoff(backoff_factor=10), result_storage_key="game_score")
 async def fetch_game_score(game_id: str) -> Dict:
-    boxscore = statsapi.boxscore_data(game_id)
+    boxscore = mlb_api_cache.boxscore_data(game_id)
 
     await emit_lineage_event(
         event_name=f"Fetch Game Score; Game ID: {game_id}",
@@ -119,7 +120,7 @@ async def fetch_game_location(game_id: str) -> Dict:
     """
     Fetch game location details for each game.
     """
-    game = statsapi.get("game", params={"gamePk": game_id})
+    game = mlb_api_cache.get("game", params={"gamePk": game_id})
 
     await emit_lineage_event(
         event_name=f"Fetch Game Location; Game ID: {game_id}",
@@ -224,6 +225,7 @@ async def mlb_simple_flow(
     await insert_game_scores(game_scores=scores, block_name=snowflake_block)
     await insert_game_locations(game_locations=locations, block_name=snowflake_block)
     sleep(timedelta(minutes=2).total_seconds())
+    print(f"MLB API cache stats: {mlb_api_cache.stats()}")
     print("MLB Simple Flow Completed Successfully.")
 
 
@@ -0,0 +1,230 @@
+# mlb_api_cache.py
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, Optional
+
+import statsapi
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get("MLB_API_CACHE_PATH", "./mlb_api_cache.sqlite")
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+# Time-to-live per kind of response, in seconds. None means never expire.
+FINAL_GAME_TTL = None
+LIVE_GAME_TTL = 60
+SCHEDULE_TTL = 6 * 60 * 60
+
+# Detailed schedule statuses that mean a game will not change any more
+FINAL_STATUSES = ("Final", "Game Over", "Completed Early")
+
+
+def is_final_status(status: Optional[str]) -> bool:
+    """Check whether a schedule or feed status describes a finished game."""
+    return bool(status) and status.startswith(FINAL_STATUSES)
+
+
+class MLBApiCache:
+    """
+    Persistent SQLite cache for MLB Stats API responses.
+
+    Entries are keyed on endpoint plus params. Final games never expire,
+    games that are not final yet get a short TTL and schedules a medium one.
+    Once the stored payloads exceed max_bytes the least recently used
+    entries are evicted. The SQLite file is only created on first use.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    expires_at REAL,
+                    last_accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS game_status (
+                    game_id INTEGER PRIMARY KEY,
+                    status TEXT NOT NULL
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits when the block succeeds and is always closed."""
+        # A connection per call keeps the cache safe to use from task threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with self._lock:
+                if not self._initialized:
+                    self._initialize(conn)
+                    self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> str:
+        return f"{endpoint}:{json.dumps(params, sort_keys=True, default=str)}"
+
+    def _record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, endpoint: str, params: Dict) -> Optional[Any]:
+        """Return the cached response, or None if it is missing or expired."""
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                self._record(hit=False)
+                return None
+            conn.execute(
+                "UPDATE responses SET last_accessed = ? WHERE key = ?", (now, key)
+            )
+
+        self._record(hit=True)
+        return json.loads(zlib.decompress(row[0]))
+
+    def store(
+        self, endpoint: str, params: Dict, response: Any, ttl: Optional[float]
+    ) -> None:
+        """Store a response, expiring it after ttl seconds (never if ttl is None)."""
+        key = self.make_key(endpoint, params)
+        payload = zlib.compress(json.dumps(response).encode("utf-8"))
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), expires_at, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total_bytes = conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM responses"
+        ).fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        # Drop expired entries first, then the least recently used ones
+        conn.execute(
+            "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        rows = conn.execute(
+            "SELECT key, size_bytes FROM responses ORDER BY last_accessed"
+        ).fetchall()
+        total_bytes = sum(size for _, size in rows)
+        evicted = []
+        for key, size in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_bytes -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} entries from the MLB API cache.")
+
+    def record_game_statuses(self, statuses: Dict[int, str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO game_status VALUES (?, ?)",
+                [(int(game_id), status) for game_id, status in statuses.items()],
+            )
+
+    def game_status(self, game_id) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status FROM game_status WHERE game_id = ?", (int(game_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def game_ttl(self, game_id) -> Optional[float]:
+        if is_final_status(self.game_status(game_id)):
+            return FINAL_GAME_TTL
+        return LIVE_GAME_TTL
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus the current size on disk."""
+        with self._connect() as conn:
+            entries, total_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": total_bytes,
+        }
+
+    def schedule(self, **kwargs) -> list:
+        """Cached statsapi.schedule; also remembers each game's status."""
+        schedule = self.lookup("schedule", kwargs)
+        if schedule is None:
+            schedule = statsapi.schedule(**kwargs)
+            self.store("schedule", kwargs, schedule, ttl=SCHEDULE_TTL)
+            self.record_game_statuses(
+                {game["game_id"]: game["status"] for game in schedule}
+            )
+        return schedule
+
+    def boxscore_data(self, game_id) -> Dict:
+        """Cached statsapi.boxscore_data, kept forever once the game is final."""
+        params = {"gamePk": int(game_id)}
+        boxscore = self.lookup("boxscore_data", params)
+        if boxscore is None:
+            boxscore = statsapi.boxscore_data(game_id)
+            self.store("boxscore_data", params, boxscore, ttl=self.game_ttl(game_id))
+        return boxscore
+
+    def get(self, endpoint: str, params: Dict) -> Dict:
+        """Cached statsapi.get; game feeds are kept forever once final."""
+        response = self.lookup(endpoint, params)
+        if response is None:
+            response = statsapi.get(endpoint, params)
+            ttl = SCHEDULE_TTL
+            if endpoint == "game":
+                status = (
+                    response.get("gameData", {}).get("status", {}).get("detailedState")
+                )
+                if status:
+                    self.record_game_statuses({params["gamePk"]: status})
+                ttl = FINAL_GAME_TTL if is_final_status(status) else LIVE_GAME_TTL
+            self.store(endpoint, params, response, ttl=ttl)
+        return response
+
+
+mlb_api_cache = MLBApiCache()
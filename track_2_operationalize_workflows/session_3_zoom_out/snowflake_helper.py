@@ -6,11 +6,39 @@ import logging
 from typing import List, Dict
 import asyncio
 from prefect._experimental.lineage import emit_lineage_event
+import pyarrow as pa
+from snowflake_loader import get_loader
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Loaded columns of each table, with the Arrow type used for staged Parquet files
+GAME_SCORES_COLUMNS = [
+    ("game_id", pa.int64()),
+    ("home_team_id", pa.int64()),
+    ("home_team", pa.string()),
+    ("away_team_id", pa.int64()),
+    ("away_team", pa.string()),
+    ("home_score", pa.int64()),
+    ("away_score", pa.int64()),
+    ("score_differential", pa.int64()),
+    ("game_time", pa.string()),
+]
+
+GAME_LOCATIONS_COLUMNS = [
+    ("game_id", pa.int64()),
+    ("venue_id", pa.int64()),
+    ("venue_name", pa.string()),
+    ("venue_city", pa.string()),
+    ("venue_state", pa.string()),
+    ("venue_postal_code", pa.string()),
+    ("venue_country", pa.string()),
+    ("venue_latitude", pa.float64()),
+    ("venue_longitude", pa.float64()),
+    ("venue_elevation", pa.float64()),
+]
+
 
 @task(result_storage_key="game_scores")
 async def setup_tables(block_name: str):
@@ -66,7 +94,7 @@ async def setup_tables(block_name: str):
 
 @task(result_storage_key="game_scores")
 async def insert_game_scores(game_scores: List[Dict], block_name: str):
-    """Insert game scores data into Snowflake."""
+    """Upsert game scores data into Snowflake, one row per game."""
     if not game_scores:
         logger.info("No game scores to insert.")
         return
@@ -75,34 +103,11 @@ async def insert_game_scores(game_scores: List[Dict], block_name: str):
         # Load the Snowflake connector asynchronously
         snowflake_connector = await SnowflakeConnector.load(block_name)
 
-        # Define the SQL statement
-        insert_sql = """
-            INSERT INTO DEV_DAY.PUBLIC.GAME_SCORES (
-                GAME_ID,
-                HOME_TEAM_ID,
-                HOME_TEAM,
-                AWAY_TEAM_ID,
-                AWAY_TEAM,
-                HOME_SCORE,
-                AWAY_SCORE,
-                SCORE_DIFFERENTIAL,
-                GAME_TIME
-            )
-            VALUES (
-                %(game_id)s,
-                %(home_team_id)s,
-                %(home_team)s,
-                %(away_team_id)s,
-                %(away_team)s,
-                %(home_score)s,
-                %(away_score)s,
-                %(score_differential)s,
-                %(game_time)s
-            );
-        """
-
-        # Execute the insert asynchronously
-        snowflake_connector.execute_many(insert_sql, game_scores)
+        # Stage the rows and merge them on GAME_ID, so rerunning the flow
+        # for the same games never duplicates them
+        get_loader().merge(
+            snowflake_connector, "DEV_DAY.PUBLIC.GAME_SCORES", GAME_SCORES_COLUMNS, game_scores
+        )
         await emit_lineage_event(
             event_name="Upload Game Scores to Snowflake",
             upstream_resources=None,
@@ -117,7 +122,7 @@ async def insert_game_scores(game_scores: List[Dict], block_name: str):
             direction_of_run_from_event="upstream",
         )
 
-        logger.info(f"Inserted {len(game_scores)} game scores into Snowflake.")
+        logger.info(f"Merged {len(game_scores)} game scores into Snowflake.")
 
     except Exception as e:
         logger.error(f"Failed to insert game scores: {e}")
@@ -126,7 +131,7 @@ async def insert_game_scores(game_scores: List[Dict], block_name: str):
 
 @task(result_storage_key="game_locations")
 async def insert_game_locations(game_locations: List[Dict], block_name: str):
-    """Insert game locations data into Snowflake."""
+    """Upsert game locations data into Snowflake, one row per game."""
     if not game_locations:
         logger.info("No game locations to insert.")
         return
@@ -135,36 +140,11 @@ async def insert_game_locations(game_locations: List[Dict], block_name: str):
         # Load the Snowflake connector asynchronously
         snowflake_connector = await SnowflakeConnector.load(block_name)
 
-        # Define the SQL statement
-        insert_sql = """
-            INSERT INTO DEV_DAY.PUBLIC.GAME_LOCATIONS (
-                GAME_ID,
-                VENUE_ID,
-                VENUE_NAME,
-                VENUE_CITY,
-                VENUE_STATE,
-                VENUE_POSTAL_CODE,
-                VENUE_COUNTRY,
-                VENUE_LATITUDE,
-                VENUE_LONGITUDE,
-                VENUE_ELEVATION
-            )
-            VALUES (
-                %(game_id)s,
-                %(venue_id)s,
-                %(venue_name)s,
-                %(venue_city)s,
-                %(venue_state)s,
-                %(venue_postal_code)s,
-                %(venue_country)s,
-                %(venue_latitude)s,
-                %(venue_longitude)s,
-                %(venue_elevation)s
-            );
-        """
-
-        # Execute the insert asynchronously
-        snowflake_connector.execute_many(insert_sql, game_locations)
+        # Stage the rows and merge them on GAME_ID, so rerunning the flow
+        # for the same games never duplicates them
+        get_loader().merge(
+            snowflake_connector, "DEV_DAY.PUBLIC.GAME_LOCATIONS", GAME_LOCATIONS_COLUMNS, game_locations
+        )
         await emit_lineage_event(
             event_name="Upload Game Locations to Snowflake",
             upstream_resources=None,
@@ -178,7 +158,7 @@ async def insert_game_locations(game_locations: List[Dict], block_name: str):
             ],
             direction_of_run_from_event="upstream",
         )
-        logger.info(f"Inserted {len(game_locations)} game locations into Snowflake.")
+        logger.info(f"Merged {len(game_locations)} game locations into Snowflake.")
 
         # Optionally, emit a lineage event after inserting game locations
         # await emit_lineage_event(...)
@@ -0,0 +1,198 @@
+# snowflake_loader.py
+
+import logging
+import os
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# "staged" bulk loads through PUT + COPY INTO, "insert" binds every row with execute_many
+LOAD_MODE = os.environ.get("SNOWFLAKE_LOAD_MODE", "staged")
+
+# Column name and Arrow type for each loaded column, in table order
+Columns = List[Tuple[str, pa.DataType]]
+
+# Where StagedParquetLoader puts batch files before COPY INTO
+STAGE = "@~/mlb_loads"
+
+# One key column, or several that together identify a row
+Key = Union[str, List[str]]
+
+
+def rows_to_table(rows: List[Dict], columns: Columns) -> pa.Table:
+    """Build a typed Arrow table from row dicts, keeping only the loaded columns."""
+    return pa.table(
+        {name: pa.array([row.get(name) for row in rows], arrow_type) for name, arrow_type in columns}
+    )
+
+
+def key_columns(key: Key) -> List[str]:
+    return [name.upper() for name in ([key] if isinstance(key, str) else key)]
+
+
+def write_parquet_batch(rows: List[Dict], columns: Columns, directory: str, table: str) -> str:
+    """Write one batch as a compressed Parquet file with a unique name and return its path."""
+    file_name = f"{table.split('.')[-1].lower()}_{uuid.uuid4().hex}.parquet"
+    path = os.path.join(directory, file_name)
+    pq.write_table(rows_to_table(rows, columns), path, compression="zstd")
+    return path
+
+
+class RowLoader(ABC):
+    """
+    Loads a batch of row dicts into a table through a connector.
+
+    The connector only needs execute(sql) and execute_many(sql, seq_of_parameters),
+    as SnowflakeConnector provides, so a local stand-in can be used in tests.
+    """
+
+    @abstractmethod
+    def load(self, connector, table: str, columns: Columns, rows: List[Dict]) -> int:
+        """Append rows to table and return the number of rows loaded."""
+
+    def execute(self, connector, sql: str) -> None:
+        connector.execute(sql)
+
+    def staging_table(self, table: str) -> str:
+        """Unique name for a temporary staging table next to table."""
+        return f"{table}_STAGING_{uuid.uuid4().hex[:8].upper()}"
+
+    def merge(self, connector, table: str, columns: Columns, rows: List[Dict], key: Key = "game_id") -> int:
+        """
+        Upsert rows into table on key (one column or a list of columns), so
+        reloading the same rows never duplicates them.
+
+        The rows are loaded into a temporary staging table, deduplicated on key
+        and merged into table in one statement: existing keys are updated and
+        new keys inserted.
+        """
+        staging = self.staging_table(table)
+        names = [name.upper() for name, _ in columns]
+        keys = key_columns(key)
+        partition = ", ".join(keys)
+
+        self.execute(connector, f"CREATE TEMPORARY TABLE {staging} AS SELECT {', '.join(names)} FROM {table} WHERE 1 = 0;")
+        try:
+            self.load(connector, staging, columns, rows)
+            self.execute(
+                connector,
+                f"""
+                MERGE INTO {table} AS target
+                USING (
+                    SELECT * FROM {staging}
+                    QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {partition}) = 1
+                ) AS source
+                ON {" AND ".join(f"target.{name} = source.{name}" for name in keys)}
+                WHEN MATCHED THEN UPDATE SET {", ".join(f"{name} = source.{name}" for name in names if name not in keys)}
+                WHEN NOT MATCHED THEN INSERT ({", ".join(names)})
+                    VALUES ({", ".join(f"source.{name}" for name in names)});
+                """,
+            )
+        finally:
+            self.execute(connector, f"DROP TABLE IF EXISTS {staging};")
+        return len(rows)
+
+
+class InsertLoader(RowLoader):
+    """Binds every row as parameters of an INSERT statement."""
+
+    def load(self, connector, table: str, columns: Columns, rows: List[Dict]) -> int:
+        names = [name for name, _ in columns]
+        connector.execute_many(
+            f"""
+            INSERT INTO {table} ({", ".join(name.upper() for name in names)})
+            VALUES ({", ".join(f"%({name})s" for name in names)});
+            """,
+            seq_of_parameters=[{name: row.get(name) for name in names} for row in rows],
+        )
+        return len(rows)
+
+
+class StagedParquetLoader(RowLoader):
+    """
+    Writes the batch to a compressed Parquet file, PUTs it on the user stage
+    and loads it with a single COPY INTO, which purges the staged file.
+    """
+
+    def load(self, connector, table: str, columns: Columns, rows: List[Dict]) -> int:
+        # The user stage works for every table, including temporary staging tables
+        stage = STAGE
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_parquet_batch(rows, columns, directory, table)
+            file_name = os.path.basename(path)
+            connector.execute(
+                f"PUT 'file://{path}' {stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE;"
+            )
+
+        connector.execute(
+            f"""
+            COPY INTO {table}
+            FROM {stage}
+            FILES = ('{file_name}')
+            FILE_FORMAT = (TYPE = PARQUET)
+            MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+            PURGE = TRUE;
+            """
+        )
+        return len(rows)
+
+
+class DuckDBLoader(RowLoader):
+    """
+    Local stand-in for StagedParquetLoader: the same Parquet batch is loaded
+    into a DuckDB database with read_parquet instead of PUT + COPY INTO, and
+    merge() runs the same MERGE INTO statement as on Snowflake. The connector
+    argument is ignored.
+    """
+
+    def __init__(self, database: str = ":memory:"):
+        import duckdb
+
+        self.connection = duckdb.connect(database)
+
+    def execute(self, connector, sql: str) -> None:
+        self.connection.execute(sql)
+
+    def staging_table(self, table: str) -> str:
+        # DuckDB keeps temporary tables in their own schema
+        return super().staging_table(table.split(".")[-1])
+
+    def load(self, connector, table: str, columns: Columns, rows: List[Dict]) -> int:
+        names = ", ".join(name.upper() for name, _ in columns)
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_parquet_batch(rows, columns, directory, table)
+            self.connection.execute(
+                f"INSERT INTO {table} ({names}) SELECT {', '.join(name for name, _ in columns)} FROM read_parquet(?)",
+                [path],
+            )
+        return len(rows)
+
+
+LOADERS = {
+    "staged": StagedParquetLoader,
+    "insert": InsertLoader,
+}
+
+_loader: Optional[RowLoader] = None
+
+
+def get_loader() -> RowLoader:
+    """The loader used by the Snowflake insert tasks, chosen by SNOWFLAKE_LOAD_MODE."""
+    global _loader
+    if _loader is None:
+        _loader = LOADERS[LOAD_MODE]()
+        logger.info(f"Loading Snowflake rows with {type(_loader).__name__}.")
+    return _loader
+
+
+def set_loader(loader: RowLoader) -> None:
+    """Plug in a different loader, e.g. a DuckDBLoader in tests."""
+    global _loader
+    _loader = loader
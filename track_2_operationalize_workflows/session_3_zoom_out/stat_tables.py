@@ -0,0 +1,153 @@
+# stat_tables.py
+
+from typing import Dict, List, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Each column is (column name, boxscore key, Arrow type). Game and team columns
+# use the keys "game_id", "game_date", "team_id" and "team_name", which are
+# filled in from the game rather than from the player entry.
+BATTING_COLUMNS: List[Tuple[str, str, pa.DataType]] = [
+    ("game_id", "game_id", pa.int64()),
+    ("game_date", "game_date", pa.date32()),
+    ("team_id", "team_id", pa.int64()),
+    ("team_name", "team_name", pa.string()),
+    ("player_id", "personId", pa.int64()),
+    ("player_name", "name", pa.string()),
+    ("position", "position", pa.string()),
+    ("batting_order", "battingOrder", pa.string()),
+    ("ab", "ab", pa.int64()),
+    ("r", "r", pa.int64()),
+    ("h", "h", pa.int64()),
+    ("doubles", "doubles", pa.int64()),
+    ("triples", "triples", pa.int64()),
+    ("hr", "hr", pa.int64()),
+    ("rbi", "rbi", pa.int64()),
+    ("bb", "bb", pa.int64()),
+    ("k", "k", pa.int64()),
+    ("lob", "lob", pa.int64()),
+    ("avg", "avg", pa.float64()),
+    ("ops", "ops", pa.float64()),
+    ("obp", "obp", pa.float64()),
+    ("slg", "slg", pa.float64()),
+]
+
+PITCHING_COLUMNS: List[Tuple[str, str, pa.DataType]] = [
+    ("game_id", "game_id", pa.int64()),
+    ("game_date", "game_date", pa.date32()),
+    ("team_id", "team_id", pa.int64()),
+    ("team_name", "team_name", pa.string()),
+    ("player_name", "name", pa.string()),
+    ("player_id", "personId", pa.int64()),
+    ("note", "note", pa.string()),
+    # Innings as a decimal number: the boxscore's "6.2" (6 2/3 innings) becomes 6.667
+    ("ip", "ip", pa.float64()),
+    ("h", "h", pa.int64()),
+    ("r", "r", pa.int64()),
+    ("er", "er", pa.int64()),
+    ("bb", "bb", pa.int64()),
+    ("k", "k", pa.int64()),
+    ("hr", "hr", pa.int64()),
+    ("era", "era", pa.float64()),
+    ("pitches", "p", pa.int64()),
+    ("strikes", "s", pa.int64()),
+]
+
+GAME_KEYS = ("game_id", "game_date", "team_id", "team_name")
+
+# Numbers as the boxscore writes them, e.g. "4", ".250" or "3.86". Anything
+# else ("-.--" for an undefined ERA, "") becomes null.
+NUMBER_PATTERN = r"^-?(\d+\.?\d*|\.\d+)$"
+
+# Innings pitched are written in thirds, the digit after the point counts outs
+INNINGS_KEYS = {"ip"}
+
+
+def schema_for(columns: List[Tuple[str, str, pa.DataType]]) -> pa.Schema:
+    return pa.schema([(name, arrow_type) for name, _, arrow_type in columns])
+
+
+BATTING_SCHEMA = schema_for(BATTING_COLUMNS)
+PITCHING_SCHEMA = schema_for(PITCHING_COLUMNS)
+
+
+def to_typed_column(raw: pa.Array, arrow_type: pa.DataType) -> pa.Array:
+    """Cast a column of raw strings to its Arrow type in one vectorized pass."""
+    if pa.types.is_string(arrow_type):
+        return pc.fill_null(raw, "")
+    if pa.types.is_date(arrow_type):
+        return pc.cast(pc.strptime(raw, format="%Y/%m/%d", unit="s"), arrow_type)
+
+    numbers = pc.if_else(pc.match_substring_regex(raw, NUMBER_PATTERN), raw, None)
+    return pc.cast(numbers, arrow_type)
+
+
+def innings_to_decimal(innings: pa.Array) -> pa.Array:
+    """Convert innings in thirds notation, e.g. 6.2, to a decimal number of innings."""
+    whole = pc.floor(innings)
+    outs = pc.round(pc.multiply(pc.subtract(innings, whole), 10))
+    return pc.add(whole, pc.divide(outs, 3))
+
+
+def to_stat_column(raw: pa.Array, boxscore_key: str, arrow_type: pa.DataType) -> pa.Array:
+    column = to_typed_column(raw, arrow_type)
+    return innings_to_decimal(column) if boxscore_key in INNINGS_KEYS else column
+
+
+def artifact_rows(table: pa.Table) -> List[Dict]:
+    """Rows of a stat table with dates as ISO strings, which table artifacts can serialize."""
+    for index, field in enumerate(table.schema):
+        if pa.types.is_date(field.type):
+            table = table.set_column(index, field.name, pc.cast(table.column(index), pa.string()))
+    return table.to_pylist()
+
+
+def extract_stat_table(
+    boxscores: Dict[int, Dict],
+    player_group: str,
+    columns: List[Tuple[str, str, pa.DataType]],
+) -> pa.Table:
+    """
+    Extract one row per player for many games at once into a typed Arrow table.
+
+    boxscores maps the schedule's game ID to its statsapi.boxscore_data result
+    and player_group is "Batters" or "Pitchers". The Python loop only copies raw
+    values into string columns; all type conversion happens column-wise in Arrow.
+    """
+    raw_columns = {boxscore_key: [] for _, boxscore_key, _ in columns}
+    player_keys = [key for _, key, _ in columns if key not in GAME_KEYS]
+
+    for game_id, boxscore in boxscores.items():
+        # gameId looks like "2024/06/01/miamlb-nynmlb-1"
+        game_date = "/".join(boxscore["gameId"].split("/")[0:3])
+        for team_type in ["home", "away"]:
+            team_info = boxscore["teamInfo"][team_type]
+            # Skip the first element, which is the header row
+            players = [
+                player
+                for player in boxscore.get(f"{team_type}{player_group}", [])[1:]
+                if isinstance(player, dict)
+            ]
+            game_values = {
+                "game_id": str(game_id),
+                "game_date": game_date,
+                "team_id": str(team_info["id"]),
+                "team_name": str(team_info["teamName"]),
+            }
+            for key, value in game_values.items():
+                if key in raw_columns:
+                    raw_columns[key].extend([value] * len(players))
+            for key in player_keys:
+                raw_columns[key].extend(
+                    None if player.get(key) is None else str(player[key])
+                    for player in players
+                )
+
+    return pa.table(
+        [
+            to_stat_column(pa.array(raw_columns[boxscore_key], pa.string()), boxscore_key, arrow_type)
+            for _, boxscore_key, arrow_type in columns
+        ],
+        schema=schema_for(columns),
+    )